@@ -73,21 +73,29 @@ def get_alias(model_input=None, alias=None):
     return alias
 
 
-def rename_dataset(alias: dict, input_file: str) -> xr.Dataset:
+def rename_dataset(alias: dict, input_file: str,
+                   chunks: dict = None) -> xr.Dataset:
     """
     Rename the variables/dimensions in the dataset using alias.
 
     Args:
         alias (dict): Dictionary with variable/dimension names
         input_file (str): Path to netCDF dataset.
+        chunks (dict or str, optional): Open the dataset lazily (dask) with
+        these chunks. Keys can use the file or the MYCOAST names
+        (e.g. {"time": 24}).
 
     Returns:
         renamed_dataset (TYPE): Dataset with variables/dimension renamed.
 
     """
 
-    raw_dataset = xr.open_dataset(input_file)
+    if isinstance(chunks, dict):
+        inverse_alias = {value: key for key, value in alias.items()}
+        chunks = {inverse_alias.get(dim, dim): size
+                  for dim, size in chunks.items()}
+
+    raw_dataset = xr.open_dataset(input_file, chunks=chunks)
     renamed_dataset = raw_dataset.rename(alias)
 
     return renamed_dataset
-
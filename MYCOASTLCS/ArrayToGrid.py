@@ -13,11 +13,21 @@ the deformation.
 To perform this change the grid_shape variable with dimensions [nz,ny,nx]
 must be provided.
 
+If the dataset was opened lazily (dask chunks), the reshape and the land
+mask stay lazy dask operations.
+
+The land mask (particles that never moved from their initial position) is
+accumulated over blocks of timesteps into a packed bitmask with one bit per
+particle, so it never needs a boolean array of the size of the trajectories.
+
 
 """
 
+import numpy as np
 import xarray as xr
 
+LAND_MASK_TIME_BLOCK = 64
+
 
 class ArrayToGrid:
 
@@ -27,7 +37,8 @@ class ArrayToGrid:
         self.coords_labels = ['time', 'z0', 'y0', 'x0']
         self.ds = []
 
-    def array_to_grid(self, ds: xr.Dataset, grid_shape):
+    def array_to_grid(self, ds: xr.Dataset, grid_shape, geometry=None,
+                      land_mask=None):
         """
 
         This functions turns the input dataset comming from lagrangian model
@@ -36,6 +47,11 @@ class ArrayToGrid:
         Args:
             - ds(xr.Dataset) : netcdf xarray dataset with dimensions [id,time]
             - grid_shape(list): grid of shape of points.
+            - geometry(GridGeometry, optional): cached grid geometry. The
+            initial coordinates are reused from it, or stored in it.
+            - land_mask(dict, optional): packed bitmask to apply (see
+            get_land_mask), e.g. from all the timesteps of a file when only
+            some of them are in ds. Default, from the timesteps of ds.
 
 
         Returns:
@@ -51,17 +67,22 @@ class ArrayToGrid:
 
         nvars = 3
         grid_data = [ds.z, ds.y, ds.x]
-        ds['x0'] = ds.x.isel(time=0).values.reshape(grid_shape)[0, 0, :]
-        ds['y0'] = ds.y.isel(time=0).values.reshape(grid_shape)[0, :, 0]
-        ds['z0'] = ds.z.isel(time=0).values.reshape(grid_shape)[:, 0, 0]
+        if (geometry is not None) and (geometry.coords is not None):
+            ds['z0'], ds['y0'], ds['x0'] = geometry.coords
+        else:
+            ds['x0'] = ds.x.isel(time=0).values.reshape(grid_shape)[0, 0, :]
+            ds['y0'] = ds.y.isel(time=0).values.reshape(grid_shape)[0, :, 0]
+            ds['z0'] = ds.z.isel(time=0).values.reshape(grid_shape)[:, 0, 0]
+            if geometry is not None:
+                geometry.set_coords(ds.z0.values, ds.y0.values, ds.x0.values)
         coords_data = [ds.time.data, ds.z0.data, ds.y0.data, ds.x0.data]
 
         # Setting the grid coordinates
         coords = dict(zip(self.coords_labels,
                           zip(self.coords_labels, coords_data)))
 
-        # Transform the variables into a structure grid
-        variables_in_grid_form = [var_to_reshape.values.reshape(
+        # Transform the variables into a structure grid (lazy for dask)
+        variables_in_grid_form = [var_to_reshape.data.reshape(
             [ds.time.size]+grid_shape) for var_to_reshape in grid_data]
 
         # Transform the variables into a dataset format.
@@ -69,7 +90,10 @@ class ArrayToGrid:
              nvars*[self.coords_labels], list(variables_in_grid_form))))
 
         ds_output = xr.Dataset(variables_in_ds_form, coords=coords)
-        ds_output = land_data_to_nan(ds_output)
+        if land_mask is None:
+            ds_output = land_data_to_nan(ds_output)
+        else:
+            ds_output = apply_land_mask(ds_output, land_mask)
         ds_output = squeeze_z_dim(ds_output)
 
         return ds_output
@@ -90,6 +114,74 @@ def squeeze_z_dim(ds: xr.Dataset):
     return ds
 
 
+def get_land_mask(ds: xr.Dataset, time_block: int = LAND_MASK_TIME_BLOCK):
+    """ Packed bitmask of the points with no movement in all the timesteps
+    from initial time instant. The comparison is accumulated over blocks of
+    timesteps (or over the dask chunks of a lazy dataset), read one at a time
+    from datasets opened from a file.
+
+    Args:
+        - ds(xr.Dataset): netcdf xarray dataset with dimensions
+        [time,z0,y0,x0] (or [time, particle], in the same order)
+        - time_block(int): timesteps compared at once.
+
+    Returns:
+        - land_mask(dict): packed bitmask (np.packbits) of each variable.
+
+    """
+    land_mask = {}
+    for var in ds.data_vars:
+        data = ds[var].transpose('time', ...)
+        if data.chunks is not None:
+            data = data.data
+            still = (data == data[0:1]).all(axis=0).compute()
+        else:
+            r0 = data.isel(time=0).values
+            moved = np.zeros(r0.shape, dtype=bool)
+            for i0 in range(0, data.shape[0], time_block):
+                block = data.isel(time=slice(i0, i0 + time_block)).values
+                moved |= (block != r0).any(axis=0)
+            still = ~moved
+        land_mask[var] = np.packbits(still, axis=None)
+    return land_mask
+
+
+def apply_land_mask(ds: xr.Dataset, land_mask: dict):
+    """ Set to NaN the points of the land mask. Numpy data is masked in
+    place and dask data lazily, when it is computed.
+
+    Args:
+        - ds(xr.Dataset): netcdf xarray dataset with dimensions
+        [time,z0,y0,x0]
+        - land_mask(dict): packed bitmask of each variable (get_land_mask).
+
+    Returns:
+        - ds(xr.Dataset): netcdf xarray dataset with dimensions
+        [time,z0,y0,x0]
+
+    """
+    for var in land_mask:
+        dims = ('time',) + tuple(dim for dim in ds[var].dims if dim != 'time')
+        data = ds[var].transpose(*dims).data
+        shape = data.shape[1:]
+        still = np.unpackbits(land_mask[var], count=int(np.prod(shape)))
+        still = still.reshape(shape).astype(bool)
+        if is_lazy(data):
+            import dask.array as da
+            ds[var] = (dims, da.where(still, np.nan, data))
+        elif still.any():
+            if (data.dtype.kind != 'f') or (not data.flags.writeable):
+                data = data.astype(np.result_type(data.dtype, np.float32))
+            data[:, still] = np.nan
+            ds[var] = (dims, data)
+    return ds
+
+
+def is_lazy(data) -> bool:
+    """ True for dask arrays. """
+    return hasattr(data, 'chunks') and not isinstance(data, np.ndarray)
+
+
 def land_data_to_nan(ds: xr.Dataset):
     """ Mask those values with no movement in all the timesteps from initial
     time instant.
@@ -102,5 +194,4 @@ def land_data_to_nan(ds: xr.Dataset):
         - ds(xr.Dataset): netcdf xarray dataset with dimensions [id,time]
 
     """
-    mask = (ds.isel(time=0) == ds).all(dim='time')
-    return ds.where(mask == False)
+    return apply_land_mask(ds, get_land_mask(ds))
@@ -4,12 +4,21 @@ import json
 import glob
 import xarray as xr
 import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from MYCOASTLCS.Aliasing import get_alias, rename_dataset
 from .ArrayToGrid import ArrayToGrid
 from .FTLE import FTLE
 from .LCS import LCS
 from .Concentrations import Concentrations
 from .ResidenceTime import ResidenceTime
+from .GridBased import CellIndex
+from .Tiling import TiledFTLE
+from .Streaming import StreamedGridBased, STREAM_TIME_CHUNK
+from .GridGeometry import get_grid_geometry
+from .StreamWriter import StreamWriter, get_sample_dims
+from .Manifest import Manifest, get_file_stamp
 
 
 class Common:
@@ -21,6 +30,15 @@ class Common:
         self.grid_shape = []
         self.ftle_LCS_only = True
         self.disk_or_mem = 'disk'
+        self.tile_size = None
+        self.stream_time_chunk = None
+        self.cell_index_dir = None
+        self.fused = False
+        self.chunks = None
+        self.geometry_file = None
+        self.n_workers = 1
+        self.manifest_file = None
+        self.backward_files = {}
 
     def read_json(self, case_json):
 
@@ -38,60 +56,533 @@ class Common:
 
         self.grid_shape = self.setup_file['common']['grid_shape']
 
+        if 'tile_size' in self.setup_file['common']:
+            self.tile_size = self.setup_file['common']['tile_size']
+
+        if 'stream_time_chunk' in self.setup_file['common']:
+            self.stream_time_chunk = \
+                self.setup_file['common']['stream_time_chunk']
+
+        # Single traversal of the input for all the stages
+        if 'fused' in self.setup_file['common']:
+            self.fused = self.setup_file['common']['fused']
+
+        # Memory-mapped cell index shared by CONC/RESD
+        if 'cell_index_dir' in self.setup_file['common']:
+            self.cell_index_dir = self.setup_file['common']['cell_index_dir']
+
+        if 'n_workers' in self.setup_file['common']:
+            self.n_workers = self.setup_file['common']['n_workers']
+
+        # Outputs written to disk or returned in memory
+        if 'disk_or_mem' in self.setup_file['common']:
+            self.disk_or_mem = self.setup_file['common']['disk_or_mem']
+
+        # Checkpoint/resume manifest
+        if 'manifest' in self.setup_file['common']:
+            self.manifest_file = self.setup_file['common']['manifest']
+
+        # Sidecar file of the grid geometry cache
+        if 'geometry_cache' in self.setup_file['common']:
+            self.geometry_file = self.setup_file['common']['geometry_cache']
+
+        # Lazy (dask) pipeline
+        if self.setup_file['common'].get('lazy', False):
+            self.chunks = self.setup_file['common'].get('chunks',
+                                                        {'time': 'auto'})
+
     def save_ftle_lcs_data(self, ds):
+        """
+        FTLE/LCS fields of a file as one step (its initial time) of the
+        merged output. The ridge points (LCS_<direction>_x/_y) are
+        contiguous ragged arrays indexed by time with
+        LCS_<direction>_point_count, so the points of every file are kept
+        in the merged output.
+
+        Args:
+            ds (xr.Dataset): Dataset with the FTLE/LCS fields.
+
+        Returns:
+            ds_step (xr.Dataset): Dataset with a time dimension of size 1.
+
+        """
         var_names = ['LCS_forward', 'FTLE_forward',
                      'LCS_backward', 'FTLE_backward']
         var_inside_ds = [var for var in var_names if var in ds]
         t0 = ds.time.isel(time=0)
-        ds = ds[var_inside_ds]
-        ds = ds.assign_coords(time=t0)
-        ds = ds.expand_dims('time')
+        ds_step = ds[var_inside_ds]
+        ds_step = ds_step.assign_coords(time=t0)
+        ds_step = ds_step.expand_dims('time')
+        for name in ['LCS_forward', 'LCS_backward']:
+            if (name + '_x') not in ds:
+                continue
+            if (name + '_point_count') in ds:
+                point_count = ds[name + '_point_count'].drop_vars(
+                    'time', errors='ignore')
+            else:
+                point_count = xr.DataArray(ds[name + '_x'].size)
+            ds_step[name + '_point_count'] = point_count.expand_dims(
+                time=ds_step.time.values).assign_attrs(
+                    sample_dimension=name + '_point')
+            ds_step[name + '_x'] = ds[name + '_x']
+            ds_step[name + '_y'] = ds[name + '_y']
+        return ds_step
+
+    @staticmethod
+    def concat_ftle_lcs_data(ds_step_list):
+        """
+        Merge the FTLE/LCS steps (see save_ftle_lcs_data) in time, as the
+        merged output file (StreamWriter.append): the ridge points are
+        concatenated along their sample dimension.
+
+        Args:
+            ds_step_list (list): FTLE/LCS datasets of each step.
+
+        Returns:
+            ds (xr.Dataset): Merged dataset.
+
+        """
+        sample_dims = get_sample_dims(ds_step_list[0])
+        ragged = [var for var in ds_step_list[0].data_vars
+                  if len(set(ds_step_list[0][var].dims) &
+                         set(sample_dims)) > 0]
+        ds = xr.concat([ds_step.drop_vars(ragged)
+                        for ds_step in ds_step_list], dim='time')
+        for sample_dim in sample_dims:
+            ragged_vars = [var for var in ragged
+                           if sample_dim in ds_step_list[0][var].dims]
+            ds = ds.assign(xr.concat([ds_step[ragged_vars]
+                                      for ds_step in ds_step_list],
+                                     dim=sample_dim))
         return ds
 
-    def process_one_file(self, input_file, output_file):
+    def get_stage_plan(self, ds: xr.Dataset) -> dict:
+        """
+        Plan of the variables and time indices of the input file that each
+        configured stage needs. A time index list of None means all of them.
+
+            - FTLE: initial time and the integration time index/es.
+            - LCS: no positions, it uses the FTLE field.
+            - CONC, RESD: all the timesteps.
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+
+        Returns:
+            plan (dict): {stage: {'variables': list, 'time_index': list}}
+
+        """
+        n_time = ds.time.size
+        variables = ['x', 'y', 'z']
+        plan = {}
+        if 'FTLE' in self.setup_file:
+            time_index = self.setup_file['FTLE']['integration_time_index']
+            if time_index == 'all':
+                time_index = FTLE(
+                    **self.setup_file['FTLE']).get_explore_indices(ds)
+            elif isinstance(time_index, float):
+                time_index = [-1]
+            elif not isinstance(time_index, list):
+                time_index = [time_index]
+            time_index = sorted(set([0] + [int(i) % n_time
+                                           for i in time_index]))
+            plan['FTLE'] = {'variables': variables, 'time_index': time_index}
+        if 'LCS' in self.setup_file:
+            plan['LCS'] = {'variables': [], 'time_index': []}
+        for stage in ['CONC', 'RESD']:
+            if stage in self.setup_file:
+                plan[stage] = {'variables': variables, 'time_index': None}
+
+        for stage in plan:
+            print('-> PLAN  >>', stage, plan[stage])
+        return plan
+
+    @staticmethod
+    def get_time_subset(plan: dict) -> list:
+        """
+        Union of the time indices of all the stages of a plan.
+
+        Args:
+            plan (dict): plan from get_stage_plan.
+
+        Returns:
+            time_index (list): time indices to read. None for all of them.
+
+        """
+        time_index = set()
+        for stage in plan:
+            if plan[stage]['time_index'] is None:
+                return None
+            time_index.update(plan[stage]['time_index'])
+        return sorted(time_index)
+
+    def get_ftle_setup(self, ds: xr.Dataset, time_subset: list) -> dict:
+        """
+        FTLE setup with the integration time indices moved to the positions
+        of a time subset of the input file.
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+            time_subset (list): time indices read from the input file.
+
+        Returns:
+            ftle_setup (dict): "FTLE" setup for the subset.
+
+        """
+        ftle_setup = dict(self.setup_file['FTLE'])
+        if time_subset is None:
+            return ftle_setup
+
+        n_time = ds.time.size
+        position = {index: i for i, index in enumerate(time_subset)}
+        time_index = ftle_setup['integration_time_index']
+        if time_index == 'all':
+            explore = FTLE(**ftle_setup).get_explore_indices(ds)
+            ftle_setup['explore_indices'] = [position[i] for i in explore]
+        elif isinstance(time_index, list):
+            ftle_setup['integration_time_index'] = [
+                position[int(i) % n_time] for i in time_index]
+        elif not isinstance(time_index, float):
+            ftle_setup['integration_time_index'] = \
+                position[int(time_index) % n_time]
+        return ftle_setup
+
+    def get_read_subset(self, ds: xr.Dataset, stages=None) -> list:
+        """
+        Time indices of the input file needed by the stages.
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+            stages (list, optional): stages to plan. Default, all the
+            configured ones.
+
+        Returns:
+            time_subset (list): time indices to read. None for all of them.
+
+        """
+        plan = self.get_stage_plan(ds)
+        if stages is not None:
+            plan = {stage: plan[stage] for stage in plan if stage in stages}
+        time_subset = self.get_time_subset(plan)
+        if time_subset == list(range(0, ds.time.size)):
+            time_subset = None
+        elif time_subset == []:
+            time_subset = [0]  # initial positions for the grid geometry
+        return time_subset
+
+    def read_input(self, input_file, stages=None):
+        """
+        Open an input file with only the variables and timesteps needed by
+        the stages.
+
+        Args:
+            input_file (str): input netCDF file.
+            stages (list, optional): stages to plan. Default, all the
+            configured ones.
+
+        Returns:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+            ftle_setup (dict): "FTLE" setup for the timesteps read (None
+            without FTLE).
+
+        """
         alias = get_alias(self.model, self.alias)
-        ds = rename_dataset(alias, input_file)
+        ds = rename_dataset(alias, input_file, self.chunks)
+        time_subset = self.get_read_subset(ds, stages)
+        ftle_setup = None
+        if 'FTLE' in self.setup_file:
+            ftle_setup = self.get_ftle_setup(ds, time_subset)
+        ds = ds[['x', 'y', 'z']]
+        if time_subset is not None:
+            ds = ds.isel(time=time_subset)
+        return ds, ftle_setup
+
+    def get_backward_ftle(self, backward_file, tiled):
+        """
+        FTLE (and LCS, by tiles) of the backward run of a forward/backward
+        pair. The seeding grid is shared with the forward run, so its grid
+        geometry (coordinates) is reused. The land mask is the one of the
+        backward trajectories, from the timesteps read for the FTLE.
+
+        Args:
+            backward_file (str): input netCDF file of the backward run.
+            tiled (bool): FTLE/LCS by tiles.
+
+        Returns:
+            ds_backward (xr.Dataset): Dataset with FTLE_backward.
+
+        """
+        print('-> INPUT >> Backward file:', backward_file)
+        ds, ftle_setup = self.read_input(backward_file, ['FTLE', 'LCS'])
+        if tiled is True:
+            tiled_extractor = TiledFTLE(self.grid_shape, self.tile_size,
+                                        ftle_setup,
+                                        self.setup_file.get('LCS'))
+            return tiled_extractor.get_ftle_lcs(ds)
+        geometry = get_grid_geometry(ds, self.grid_shape, self.geometry_file)
+        grid_ds = ArrayToGrid().array_to_grid(ds, self.grid_shape, geometry)
+        FTLE(**ftle_setup).get_ftle(grid_ds)
+        return grid_ds
+
+    @staticmethod
+    def add_backward_fields(grid_ds, ds_backward):
+        """
+        Add the backward fields of a forward/backward pair to the forward
+        dataset. Several integration times of the backward run are stored
+        along integration_time_backward.
+
+        Args:
+            grid_ds (xr.Dataset): Dataset with FTLE_forward.
+            ds_backward (xr.Dataset): Dataset with FTLE_backward.
+
+        Returns:
+            grid_ds (xr.Dataset): Dataset with both directions.
+
+        """
+        if ('FTLE_forward' not in grid_ds) or \
+                ('FTLE_backward' not in ds_backward):
+            print('-> INPUT >> The pair is not a forward and a backward run.',
+                  'Backward file skipped')
+            return grid_ds
+        names = [var for var in ds_backward.data_vars if 'backward' in var]
+        ds_backward = ds_backward[names].drop_vars('time', errors='ignore')
+        if 'integration_time' in ds_backward.dims:
+            ds_backward = ds_backward.rename(
+                {'integration_time': 'integration_time_backward',
+                 'integration_time_index': 'integration_time_index_backward'})
+        for var in ds_backward.data_vars:
+            grid_ds[var] = ds_backward[var]
+        return grid_ds
+
+    def process_one_file(self, input_file, merge=False):
+        """
+        Process one input file. The CONC/RESD fields are written to their
+        own files. The FTLE/LCS fields are written to the FTLE file, unless
+        they are merged with other files (merge=True), and they are
+        returned. With disk_or_mem = 'mem' nothing is written and the output
+        datasets are returned instead of the output files.
+
+        If the file has a backward pair (backward_files), the FTLE/LCS of
+        both runs are written together.
+
+        Args:
+            input_file (str): input netCDF file.
+            merge (bool, optional): the FTLE/LCS fields are only returned to
+            be appended to the merged output.
 
-        array_ds = ArrayToGrid()
-        grid_ds = array_ds.array_to_grid(ds, self.grid_shape)
+        Returns:
+            ds_ftle_lcs (xr.Dataset): FTLE/LCS fields (None for the time-scale
+            exploration).
+            outputs (dict): output files ('disk') or datasets ('mem') by
+            stage.
+
+        """
+        # CONC/RESD by chunks of timesteps read from the input file. In the
+        # fused mode the FTLE timesteps are kept from the same traversal and
+        # all the outputs are written together at the end.
+        grid_based = [stage for stage in ['CONC', 'RESD']
+                      if stage in self.setup_file]
+        streamed = ((self.stream_time_chunk is not None) or
+                    (self.fused is True)) and (len(grid_based) > 0)
+        fused = streamed and (self.fused is True)
+        pending = []
+
+        def save_output(stage, ds_stage):
+            if fused is True:
+                pending.append((stage, ds_stage))
+            else:
+                self.save_output(stage, ds_stage, outputs)
+
+        def save_pending():
+            for stage, ds_stage in pending:
+                self.save_output(stage, ds_stage, outputs)
+
+        # Only the variables and timesteps needed by the stages are read.
+        if streamed is True:
+            ds, ftle_setup = self.read_input(input_file, ['FTLE', 'LCS'])
+        else:
+            ds, ftle_setup = self.read_input(input_file)
+        backward_file = self.get_backward_file(input_file)
+
+        # FTLE/LCS by tiles. The whole grid is only built for CONC/RESD.
+        tiled = ((self.tile_size is not None) and ('FTLE' in self.setup_file)
+                 and (self.setup_file['FTLE']['integration_time_index'] != 'all'))
 
         output_filenames = self.get_output_filenames(input_file)
+        outputs = {} if self.disk_or_mem == 'mem' else output_filenames
 
-        if 'CONC' in self.setup_file:
+        geometry = None
+        if (tiled is False) or (len(grid_based) > 0):
+            geometry = get_grid_geometry(ds, self.grid_shape,
+                                         self.geometry_file)
+
+        # The land mask is obtained from the timesteps read: all of them
+        # with CONC/RESD in the plan (from the same pass when streamed), only
+        # the FTLE ones for FTLE/LCS runs, so they do not read the whole
+        # trajectories.
+        land_mask = None
+        if streamed is True:
+            capture = (fused is True) and ('FTLE' in self.setup_file) and \
+                (self.setup_file['FTLE']['integration_time_index'] != 'all')
+            ds_stages, ds_captured, land_mask = self.stream_grid_based(
+                input_file, grid_based, geometry, capture)
+            for stage in grid_based:
+                save_output(stage, ds_stages[stage])
+            if ds_captured is not None:
+                ds = ds_captured
+
+        if ((tiled is False) and ('FTLE' in self.setup_file)) or \
+                ((len(grid_based) > 0) and (streamed is False)):
+            array_ds = ArrayToGrid()
+            grid_ds = array_ds.array_to_grid(ds, self.grid_shape, geometry,
+                                             land_mask)
+
+        # The cell index of the positions is shared by CONC and RESD.
+        cell_index = None
+        if (len(grid_based) > 1) and (streamed is False):
+            cell_index = CellIndex(self.cell_index_dir)
+
+        if ('CONC' in self.setup_file) and (streamed is False):
             Count_extractor = Concentrations(**self.setup_file['CONC'])
-            conc_ds = Count_extractor.get_concentrations(grid_ds)
-            conc_ds.to_netcdf(output_filenames['CONC'])
-            conc_ds.close()
+            conc_ds = Count_extractor.get_concentrations(grid_ds, geometry,
+                                                         cell_index)
+            save_output('CONC', conc_ds)
 
-        if 'RESD' in self.setup_file:
+        if ('RESD' in self.setup_file) and (streamed is False):
             RESD_extractor = ResidenceTime(**self.setup_file['RESD'])
-            resd_ds = RESD_extractor.get_residence_time(grid_ds)
-            resd_ds.to_netcdf(output_filenames['RESD'])
-            resd_ds.close()
+            resd_ds = RESD_extractor.get_residence_time(grid_ds, geometry,
+                                                        cell_index)
+            save_output('RESD', resd_ds)
 
-        if 'FTLE' in self.setup_file:
-            FTLE_extractor = FTLE(**self.setup_file['FTLE'])
+        if cell_index is not None:
+            cell_index.close()
+
+        if geometry is not None:
+            geometry.save()
+
+        if tiled is True:
+            tiled_extractor = TiledFTLE(self.grid_shape, self.tile_size,
+                                        ftle_setup,
+                                        self.setup_file.get('LCS'))
+            grid_ds = tiled_extractor.get_ftle_lcs(ds, land_mask)
+            if backward_file is not None:
+                grid_ds = self.add_backward_fields(
+                    grid_ds, self.get_backward_ftle(backward_file, tiled))
+            if merge is False:
+                save_output('FTLE', grid_ds)
+
+        elif 'FTLE' in self.setup_file:
+            FTLE_extractor = FTLE(**ftle_setup)
             if self.setup_file['FTLE']['integration_time_index'] == 'all':
-                FTLE_extractor.explore_ftle_timescale(grid_ds)
-                grid_ds = grid_ds.drop(['x', 'y', 'z'])  # Remove duplicated.
-                grid_ds.to_netcdf(output_filenames['FTLE'])  # Save all measure.
-                return
+                if self.disk_or_mem == 'mem':
+                    outputs['FTLE'] = FTLE_extractor.explore_ftle_timescale(
+                        grid_ds)
+                else:
+                    # FTLE is written block by block.
+                    FTLE_extractor.explore_ftle_timescale(
+                        grid_ds, output_filenames['FTLE'])
+                save_pending()
+                return None, outputs
             else:
                 FTLE_extractor.get_ftle(grid_ds)
+                if backward_file is not None:
+                    grid_ds = self.add_backward_fields(
+                        grid_ds, self.get_backward_ftle(backward_file, tiled))
 
-        if 'LCS' in self.setup_file:
+        if ('LCS' in self.setup_file) and (tiled is False):
             LCS_extractor = LCS(**self.setup_file['LCS'])
             LCS_extractor.get_lcs(grid_ds)
 
+        # Per-ridge statistics table
+        if 'LCS_STATS' in output_filenames:
+            if ('LCS_forward' in grid_ds) or ('LCS_backward' in grid_ds):
+                stats = LCS(**self.setup_file['LCS']).get_ridge_stats(grid_ds)
+                save_output('LCS_STATS', stats)
+            else:
+                outputs.pop('LCS_STATS', None)
+
+        if ('FTLE' in self.setup_file) and (tiled is False) and \
+                (merge is False):
             grid_ds = grid_ds.drop(['x', 'y', 'z'])  # Remove duplicated vars
-            grid_ds.to_netcdf(output_filenames['FTLE'])  # Save all measure
+            save_output('FTLE', grid_ds)  # Save all measure
 
         # Only FTLE/LCS vars are stored in the ds to be concatenated in
         # time
-        if self.ftle_LCS_only is True:
+        ds_ftle_lcs = None
+        if (self.ftle_LCS_only is True) and ('FTLE' in self.setup_file):
             ds_ftle_lcs = self.save_ftle_lcs_data(grid_ds)
 
-        return ds_ftle_lcs, output_filenames
+        # The FTLE file of a merged step is not written
+        if (merge is True) and (self.disk_or_mem == 'disk'):
+            outputs = {stage: outputs[stage] for stage in outputs
+                       if stage != 'FTLE'}
+
+        save_pending()
+        return ds_ftle_lcs, outputs
+
+    def stream_grid_based(self, input_file, stages, geometry, capture=False):
+        """
+        Compute the CONC/RESD stages by chunks of stream_time_chunk
+        timesteps read from the input file (see Streaming).
+
+        Args:
+            input_file (str): input netCDF file.
+            stages (list): CONC and/or RESD.
+            geometry (GridGeometry): grid geometry.
+            capture (bool, optional): keep the positions of the FTLE
+            timesteps from the same traversal (fused mode).
+
+        Returns:
+            ds_stages (dict): output dataset by stage.
+            ds_captured (xr.Dataset): Lagrangian dataset with the FTLE
+            timesteps (None without capture).
+            land_mask (dict): land mask from all the timesteps.
+
+        """
+        alias = get_alias(self.model, self.alias)
+        ds = rename_dataset(alias, input_file, self.chunks)[['x', 'y', 'z']]
+        capture_index = None
+        if capture is True:
+            capture_index = self.get_read_subset(ds, ['FTLE', 'LCS'])
+            if capture_index is None:
+                capture_index = list(range(0, ds.time.size))
+        extractors = {'CONC': Concentrations, 'RESD': ResidenceTime}
+        measures = [extractors[stage](**self.setup_file[stage])
+                    for stage in stages]
+        time_chunk = self.stream_time_chunk
+        if time_chunk is None:
+            time_chunk = STREAM_TIME_CHUNK
+        streamer = StreamedGridBased(self.grid_shape, time_chunk, measures)
+        ds_outputs, ds_captured, land_mask = streamer.run(ds, geometry,
+                                                          capture_index)
+        ds.close()
+        return dict(zip(stages, ds_outputs)), ds_captured, land_mask
+
+    def save_output(self, stage, ds_stage, outputs):
+        """
+        Write the output dataset of a stage to its file ('disk') or keep it
+        in memory ('mem').
+
+        Args:
+            stage (str): stage name (FTLE, CONC, RESD, LCS_STATS).
+            ds_stage (xr.Dataset): output dataset of the stage (a
+            pd.DataFrame for LCS_STATS, written as csv).
+            outputs (dict): output files ('disk') or datasets ('mem').
+
+        Returns:
+            None.
+
+        """
+        if stage == 'LCS_STATS':
+            if self.disk_or_mem == 'mem':
+                outputs[stage] = ds_stage
+            else:
+                ds_stage.to_csv(outputs[stage], index=False)
+        elif self.disk_or_mem == 'mem':
+            outputs[stage] = ds_stage.load()
+        else:
+            ds_stage.to_netcdf(outputs[stage])
+            ds_stage.close()
 
     def get_output_filenames(self, input_filename):
         output_filenames = {}
@@ -102,43 +593,402 @@ class Common:
             output_filenames['CONC'] = base_filename + '_conc.nc'
         if 'RESD' in self.setup_file:
             output_filenames['RESD'] = base_filename + '_resd.nc'
+        if self.setup_file.get('LCS', {}).get('ridge_stats', False):
+            if 'FTLE' not in self.setup_file:
+                raise ValueError('LCS ridge_stats needs the FTLE block in '
+                                 'the setup file')
+            if self.setup_file['FTLE']['integration_time_index'] != 'all':
+                output_filenames['LCS_STATS'] = base_filename + \
+                    '_lcs_stats.csv'
 
         print('-> OUT  >>', json.dumps(output_filenames, indent=4))
         return output_filenames
 
-    def run_ftle_lcs(self, input_file_path_pattern, output_file):
+    def process_step(self, input_file):
+        """
+        Process one file of a multi-file run. The FTLE/LCS fields are loaded
+        so they can be returned by a worker process.
+
+        Args:
+            input_file (str): input netCDF file.
+
+        Returns:
+            ds_ftle_lcs (xr.Dataset): FTLE/LCS fields of the step or None.
+            outputs (dict): output files ('disk') or datasets ('mem') by
+            stage.
+
+        """
+        ds_ftle_lcs, outputs = self.process_one_file(input_file, merge=True)
+        if ds_ftle_lcs is not None:
+            ds_ftle_lcs = ds_ftle_lcs.load()
+        return ds_ftle_lcs, outputs
+
+    def get_initial_time(self, input_file):
+        """ Initial time of an input file. """
+        alias = get_alias(self.model, self.alias)
+        ds = rename_dataset(alias, input_file)
+        t0 = ds.time.values[0]
+        ds.close()
+        return t0
+
+    def set_backward_files(self, nc_file_list, backward_file_list):
+        """
+        Paired forward/backward mode. Each input file (forward run) is
+        paired with the file of backward_file_list (backward run) with the
+        same initial time, from the same seeding grid.
+
+        Args:
+            nc_file_list (list): input netCDF files of the forward run.
+            backward_file_list (list): input netCDF files of the backward
+            run.
+
+        Returns:
+            None.
+
+        """
+        self.backward_files = {}
+        if len(backward_file_list) == 0:
+            return
+        if ('FTLE' not in self.setup_file) or \
+                (self.setup_file['FTLE']['integration_time_index'] == 'all'):
+            print('-> INPUT >> Backward files need FTLE with integration',
+                  'time index/es. Skipped')
+            return
+        backward_t0 = {str(self.get_initial_time(backward_file)): backward_file
+                       for backward_file in backward_file_list
+                       if backward_file not in nc_file_list}
+        for nc_file in nc_file_list:
+            backward_file = backward_t0.get(str(self.get_initial_time(nc_file)))
+            if backward_file is None:
+                print('-> INPUT >> No backward file for:', nc_file)
+                continue
+            print('-> INPUT >> Pair:', nc_file, '+', backward_file)
+            self.backward_files[os.path.abspath(nc_file)] = \
+                os.path.abspath(backward_file)
+
+    def get_backward_file(self, input_file):
+        """ Backward file paired with an input file (or None). """
+        return self.backward_files.get(os.path.abspath(input_file))
+
+    def run_ftle_lcs(self, input_file_path_pattern, output_file=None,
+                     backward_file_path_pattern=None):
+        """
+        Process the input files. With several files, the FTLE/LCS fields of
+        each file are merged in time.
+
+        With disk_or_mem = 'mem' only the merged FTLE/LCS file is written
+        (if output_file is given) and the products are returned:
+
+            - one file: {stage: dataset}
+            - several files: {'FTLE': merged dataset, 'CONC': [datasets],
+            'RESD': [datasets], 'LCS_STATS': [tables]}, in time order.
+
+        With a manifest ('disk'), the files already processed with the same
+        setup are skipped and the merged output is rebuilt from the FTLE/LCS
+        pieces of the manifest.
+
+        With backward_file_path_pattern (paired forward/backward mode), the
+        input files are the forward runs and each one is paired with the
+        backward run starting at the same time: the FTLE/LCS outputs have
+        both directions.
+
+        Args:
+            input_file_path_pattern (str): input netCDF file/s (glob pattern).
+            output_file (str, optional): merged FTLE/LCS output file.
+            backward_file_path_pattern (str, optional): input netCDF file/s
+            of the backward run (glob pattern).
+
+        Returns:
+            products (dict): output datasets ('mem'), None ('disk').
+
+        """
         nc_file_list = sorted(glob.glob(input_file_path_pattern), key=os.path.getmtime)
         if len(nc_file_list) == 0.:
             print('-> There is not file to process. Exiting')
             return
 
+        if backward_file_path_pattern is not None:
+            self.set_backward_files(nc_file_list,
+                                    glob.glob(backward_file_path_pattern))
+
+        manifest = None
+        if (self.manifest_file is not None) and (self.disk_or_mem == 'disk'):
+            manifest = Manifest(self.manifest_file, self.setup_file)
+
         if len(nc_file_list) == 1:
+            if (manifest is not None) and \
+                    (manifest.get_entry(nc_file_list[0],
+                                        self.get_backward_file(nc_file_list[0]))
+                     is not None):
+                print('-> INPUT >> Already processed: ', nc_file_list[0])
+                return
             print('-> INPUT >> Processing file: ', nc_file_list[0])
-            self.process_one_file(nc_file_list[0], output_file)
+            _, outputs = self.process_one_file(nc_file_list[0])
+            if self.disk_or_mem == 'mem':
+                return outputs
+            if manifest is not None:
+                manifest.add(nc_file_list[0],
+                             self.get_initial_time(nc_file_list[0]), outputs,
+                             paired_file=self.get_backward_file(nc_file_list[0]))
+            return
 
-        else:
-            ds_step_list = []
-            step_file_list = []
-            step = 0
-            for nc_ftle_field in nc_file_list:
+        return self.run_files(nc_file_list, output_file, manifest)
+
+    def run_files(self, nc_file_list, output_file, manifest=None):
+        """
+        Process several input files and merge their FTLE/LCS fields in time
+        (see run_ftle_lcs).
+
+        If the merged output was already built from the first files of the
+        list, the FTLE/LCS fields of the new files are appended to it.
+
+        Args:
+            nc_file_list (list): input netCDF files.
+            output_file (str): merged FTLE/LCS output file.
+            manifest (Manifest, optional): checkpoint/resume manifest.
+
+        Returns:
+            products (dict): output datasets ('mem'), None ('disk').
+
+        """
+        # Files in time order, so the steps are appended in time order.
+        entries, t0 = {}, {}
+        for nc_file in nc_file_list:
+            entries[nc_file] = None
+            if manifest is not None:
+                entries[nc_file] = manifest.get_entry(
+                    nc_file, self.get_backward_file(nc_file))
+            if entries[nc_file] is not None:
+                t0[nc_file] = np.datetime64(entries[nc_file]['t0'])
+            else:
+                t0[nc_file] = self.get_initial_time(nc_file)
+        nc_file_list = sorted(nc_file_list, key=lambda file: t0[file])
+        todo_list = [file for file in nc_file_list if entries[file] is None]
+
+        if self.n_workers > 1:
+            print('-> INPUT >> Processing', len(todo_list), 'files with',
+                  self.n_workers, 'workers')
+            # The workers are shut down also if a step or the merge fails
+            with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+                results = executor.map(self.process_step, todo_list)
+                return self.merge_results(results, nc_file_list, entries, t0,
+                                          output_file, manifest)
+
+        def process_files():
+            for step, nc_ftle_field in enumerate(todo_list):
                 print('\n')
                 print('-> INPUT >> Processing file:', step+1, 'of ',
-                      len(nc_file_list), '>>', nc_ftle_field)
-                ds_ftle, ds_ftle_filename = self.process_one_file(nc_ftle_field, str(step).zfill(3) + '.nc')
-                if 'FTLE' in self.setup_file:
-                    fname = ds_ftle_filename['FTLE']
-                    step_file_list.append(fname)
+                      len(todo_list), '>>', nc_ftle_field)
+                yield self.process_step(nc_ftle_field)
+        return self.merge_results(process_files(), nc_file_list, entries, t0,
+                                  output_file, manifest)
+
+    def merge_results(self, results, nc_file_list, entries, t0, output_file,
+                      manifest=None):
+        """
+        Collect the results of the files of run_files, in time order, and
+        merge their FTLE/LCS fields.
+
+        Args:
+            results (iterator): (ds_ftle, outputs) of process_step for the
+            files not processed yet.
+            nc_file_list (list): input netCDF files in time order.
+            entries (dict): manifest entry of each file (None if it was not
+            processed yet).
+            t0 (dict): initial time of each file.
+            output_file (str): merged FTLE/LCS output file.
+            manifest (Manifest, optional): checkpoint/resume manifest.
+
+        Returns:
+            products (dict): output datasets ('mem'), None ('disk').
+
+        """
+        if self.disk_or_mem == 'mem':
+            products = {'CONC': [], 'RESD': [], 'LCS_STATS': []}
+            ds_step_list = []
+            for ds_ftle, outputs in results:
+                if ('FTLE' in self.setup_file) and (ds_ftle is not None):
                     ds_step_list.append(ds_ftle)
-                step = step + 1
-            print('\n')
-            if 'FTLE' in self.setup_file:
-                output_file = os.path.basename(output_file).split('.')[0] + 'ftle.nc'
-                print('-> OUT  >> Merging ftle steps into:', output_file)
-                xr.concat(ds_step_list, dim='time').to_netcdf(output_file)
-                if os.path.exists(output_file):
-                    for step_file in step_file_list:
-                        os.remove(step_file)
+                for stage in ['CONC', 'RESD', 'LCS_STATS']:
+                    if stage in outputs:
+                        products[stage].append(outputs[stage])
+            if len(ds_step_list) > 0:
+                products['FTLE'] = self.concat_ftle_lcs_data(ds_step_list)
+                if output_file is not None:
+                    output_file = os.path.basename(output_file).split('.')[0] + 'ftle.nc'
+                    print('-> OUT  >> Merged ftle steps:', output_file)
+                    products['FTLE'].to_netcdf(output_file)
+            return products
+
+        output_file = os.path.basename(output_file).split('.')[0] + 'ftle.nc'
+        writer = StreamWriter(output_file)
+        n_merged = 0
+        if manifest is not None:
+            # Pieces already in the merged output (rolling output).
+            done_pieces = []
+            for nc_file in nc_file_list:
+                if entries[nc_file] is None:
+                    break
+                done_pieces.append(entries[nc_file]['piece'])
+            merged_pieces = manifest.merged.get('pieces', [])
+            if manifest.is_merged(output_file,
+                                  done_pieces[:len(merged_pieces)]):
+                n_merged = len(merged_pieces)
+            if n_merged == len(nc_file_list):
+                print('-> INPUT >> All the files were already processed:',
+                      output_file)
+                return
+            if n_merged > 0:
+                writer.open()
+                # A run stopped between an append and the manifest update
+                n_time = len(writer.nc.dimensions['time'])
+                n_pieces = len([piece for piece in merged_pieces
+                                if piece is not None])
+                if n_time != n_pieces:
+                    print('-> OUT  >> Rebuilding', output_file, '(',
+                          n_time, 'steps for', n_pieces, 'merged pieces )')
+                    writer.close()
+                    n_merged = 0
+                else:
+                    print('-> OUT  >> Appending ftle steps to:', output_file)
+
+        try:
+            n_steps = self.append_results(results, nc_file_list, entries, t0,
+                                          writer, n_merged, manifest)
+        finally:
+            writer.close()
+        print('\n')
+        if n_steps + n_merged == 0:
+            print('-> There is no merging of the concentration and residence times calculations \n')
+
+        return
+
+    def append_results(self, results, nc_file_list, entries, t0, writer,
+                       n_merged, manifest=None) -> int:
+        """
+        Append the FTLE/LCS steps of the files to the merged output as they
+        are ready (see merge_results). With a manifest, the merged pieces
+        are recorded after every file, so a stopped run is resumed from the
+        last step in the merged output.
+
+        Args:
+            results (iterator): (ds_ftle, outputs) of process_step for the
+            files not processed yet.
+            nc_file_list (list): input netCDF files in time order.
+            entries (dict): manifest entry of each file (None if it was not
+            processed yet).
+            t0 (dict): initial time of each file.
+            writer (StreamWriter): merged output.
+            n_merged (int): files of nc_file_list already in the merged
+            output.
+            manifest (Manifest, optional): checkpoint/resume manifest.
+
+        Returns:
+            n_steps (int): steps appended to the merged output.
+
+        """
+        n_steps = 0
+        pieces = []
+        for k, nc_file in enumerate(nc_file_list):
+            if entries[nc_file] is not None:
+                print('-> INPUT >> Already processed:', nc_file)
+                ds_ftle = None
+                if (entries[nc_file]['piece'] is not None) and (k >= n_merged):
+                    ds_ftle = xr.open_dataset(entries[nc_file]['piece'])
+                    ds_ftle.load()
+                    ds_ftle.close()
+                pieces.append(entries[nc_file]['piece'])
             else:
-                print('-> There is no merging of the concentration and residence times calculations \n')
+                ds_ftle, outputs = next(results)
+                if manifest is not None:
+                    piece = None
+                    if ds_ftle is not None:
+                        piece = manifest.get_piece_filename(nc_file)
+                        ds_ftle.to_netcdf(piece)
+                    backward_file = self.get_backward_file(nc_file)
+                    manifest.add(nc_file, t0[nc_file], outputs, piece,
+                                 backward_file)
+                    pieces.append(
+                        manifest.get_entry(nc_file, backward_file)['piece'])
+            if ('FTLE' in self.setup_file) and (ds_ftle is not None):
+                if (n_steps == 0) and (n_merged == 0):
+                    print('-> OUT  >> Merging ftle steps into:',
+                          writer.filename)
+                writer.append(ds_ftle, 'time')
+                n_steps = n_steps + 1
+            if (manifest is not None) and (k >= n_merged) and \
+                    (n_steps + n_merged > 0):
+                manifest.set_merged(writer.filename, list(pieces))
+        return n_steps
+
+    def watch(self, input_file_path_pattern, output_file, interval=60.,
+              backward_file_path_pattern=None):
+        """
+        Watch mode. It polls the input files and processes the new or
+        changed ones, appending their FTLE/LCS fields to the merged output.
+        The setup, the imports and the grid geometry stay in memory between
+        polls. A file is processed once its size and modification time do
+        not change between two polls (the model finished writing it).
+
+        The files already processed are tracked with the manifest (by
+        default <output>_manifest.json).
+
+        In paired forward/backward mode, a file is processed once its
+        backward file is also ready.
+
+        Args:
+            input_file_path_pattern (str): input netCDF files (glob pattern).
+            output_file (str): merged FTLE/LCS output file.
+            interval (float, optional): seconds between polls. Default 60.
+            backward_file_path_pattern (str, optional): input netCDF files
+            of the backward run (glob pattern).
+
+        Returns:
+            None.
+
+        """
+        if self.disk_or_mem == 'mem':
+            print('-> WATCH >> Watch mode writes the outputs to disk')
+            self.disk_or_mem = 'disk'
+        if self.manifest_file is None:
+            self.manifest_file = os.path.basename(output_file).split('.')[0] + \
+                '_manifest.json'
+
+        print('-> WATCH >> Polling', input_file_path_pattern, 'every',
+              interval, 's. Ctrl+C to stop.')
+        stamps = []
+        try:
+            while True:
+                patterns = [input_file_path_pattern]
+                if backward_file_path_pattern is not None:
+                    patterns.append(backward_file_path_pattern)
+                new_stamps = []
+                for pattern in patterns:
+                    new_stamps.append({})
+                    for nc_file in glob.glob(pattern):
+                        try:
+                            new_stamps[-1][nc_file] = get_file_stamp(nc_file)
+                        except FileNotFoundError:
+                            continue
+                if len(stamps) == 0:
+                    stamps = [{} for pattern in patterns]
+                ready = [[nc_file for nc_file in new_stamps[k]
+                          if stamps[k].get(nc_file) == new_stamps[k][nc_file]]
+                         for k in range(0, len(patterns))]
+                stamps = new_stamps
+                ready_list = ready[0]
+                if backward_file_path_pattern is not None:
+                    self.set_backward_files(ready_list, ready[1])
+                    ready_list = [nc_file for nc_file in ready_list
+                                  if self.get_backward_file(nc_file)
+                                  is not None]
 
+                manifest = Manifest(self.manifest_file, self.setup_file)
+                if any([manifest.get_entry(nc_file,
+                                           self.get_backward_file(nc_file))
+                        is None for nc_file in ready_list]):
+                    self.run_files(ready_list, output_file, manifest)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print('-> WATCH >> Stopped')
         return
@@ -37,12 +37,15 @@ class Concentrations(GridBased):
         self.name = 'concentrations'
         self.abbrev = 'CONC'
 
-    def get_counts(self, ds: xr.Dataset) -> np.array:
+    def get_counts(self, ds: xr.Dataset, cell_index=None) -> np.array:
         """
         Gets the raw number of counts per cell at each timestep.
 
+        Lazy (dask) datasets are reduced chunk by chunk along time.
+
         Args:
             ds (xr.Dataset): Input dataset with particle positions
+            cell_index (CellIndex, optional): shared cell index cache.
 
         Returns:
             concentrations (np.array): Array with number of particles per cell.
@@ -51,34 +54,95 @@ class Concentrations(GridBased):
 
         print('-> CONC  >> Computing..')
 
-        n_tzyx = [ds.time.size] + list(map(np.size, self.centers))
-        concentrations = np.zeros((n_tzyx))
-
-        for i in range(0, n_tzyx[0]):
-            print('-> CONC  >> ', (i/n_tzyx[0])*100., '%', end="\r")
-            if concentrations.ndim == 4:
-                r = np.c_[ds.z[i].values.flatten(),
-                          ds.y[i].values.flatten(),
-                          ds.x[i].values.flatten()]
-            elif concentrations.ndim == 3:
-                r = np.c_[ds.y[i].values.flatten(),
-                          ds.x[i].values.flatten()]
-            concentrations[i], _ = np.histogramdd(r, bins=self.bins)
-        return concentrations
-
-    def get_concentrations(self, ds_input: xr.Dataset) -> xr.Dataset:
+        if cell_index is not None:
+            return self.count_index(cell_index.get_index(self, ds))
+
+        concentrations = self.apply_by_blocks(self.count_block, ds, 'time')
+        return np.concatenate(concentrations)
+
+    def count_block(self, z: np.array, y: np.array, x: np.array) -> np.array:
+        """
+        Gets the raw number of counts per cell for a block of timesteps.
+
+        Args:
+            z, y, x (np.array): Particle positions with time as first axis.
+
+        Returns:
+            concentrations (np.array): Array with number of particles per cell.
+
+        """
+        nt = z.shape[0]
+        index = self.get_cell_index(z.reshape(nt, -1), y.reshape(nt, -1),
+                                    x.reshape(nt, -1))
+        return self.count_index(index)
+
+    def count_index(self, index: np.array) -> np.array:
+        """
+        Gets the raw number of counts per cell at each timestep from the
+        cell index of the positions.
+
+        Args:
+            index (np.array): flat cell index [time, particle].
+
+        Returns:
+            concentrations (np.array): Array with number of particles per cell.
+
+        """
+        nt = index.shape[0]
+        n_tzyx = [nt] + list(map(np.size, self.centers))
+        n_cells = int(np.prod(n_tzyx[1:]))
+
+        # The index is shifted by timestep so a single bincount gives the
+        # counts of every timestep of a block. Each timestep has a leading
+        # slot for the particles outside the grid or NaN (index -1).
+        concentrations = np.zeros((nt, n_cells))
+        block = max(1, 2**24//max(index.shape[1], 1))
+        for i0 in range(0, nt, block):
+            i1 = min(i0 + block, nt)
+            shifted = index[i0:i1].astype(np.int64)
+            shifted += (np.arange(0, i1 - i0)*(n_cells + 1) + 1)[:, np.newaxis]
+            counts = np.bincount(shifted.ravel(),
+                                 minlength=(i1 - i0)*(n_cells + 1))
+            concentrations[i0:i1] = counts.reshape(i1 - i0, n_cells + 1)[:, 1:]
+        return concentrations.reshape(n_tzyx)
+
+    def init_stream(self, ds_input: xr.Dataset, geometry=None):
+        """ Concentrations accumulator (see GridBased.init_stream). """
+        GridBased.init_stream(self, ds_input, geometry)
+        n_tzyx = [ds_input.time.size] + list(map(np.size, self.centers))
+        self.concentrations = np.zeros(n_tzyx)
+
+    def accumulate(self, index: np.array, particles: slice, steps: slice):
+        """ Add the counts of a chunk (see GridBased.accumulate). """
+        self.concentrations[steps] += self.count_index(index)
+
+    def discard(self, index: np.array, n_steps: int = None):
+        """ Remove the counts of particles (see GridBased.discard). """
+        # A single row of index is broadcast to all the timesteps
+        self.concentrations -= self.count_index(index)
+
+    def get_stream_output(self, ds_input: xr.Dataset) -> xr.Dataset:
+        """ Concentrations dataset (see GridBased.get_stream_output). """
+        ds_output = self.init_dataset(ds_input)
+        self.to_dataset(ds_output, self.concentrations)
+        return ds_output
+
+    def get_concentrations(self, ds_input: xr.Dataset, geometry=None,
+                           cell_index=None) -> xr.Dataset:
         """
         Get the concentration and append the result to the input dataset.
 
         Args:
             ds_input (xr.Dataset): Input dataset with particle positions.
+            geometry (GridGeometry, optional): cached grid geometry.
+            cell_index (CellIndex, optional): shared cell index cache.
 
         Returns:
             ds_output (xr.Dataset): Output dataset with concentrations.
 
         """
-        self.init_grid(ds_input)
+        self.init_grid(ds_input, geometry)
         ds_output = self.init_dataset(ds_input)
-        concentrations = self.get_counts(ds_input)
+        concentrations = self.get_counts(ds_input, cell_index)
         self.to_dataset(ds_output, concentrations)
         return ds_output
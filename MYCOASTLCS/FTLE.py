@@ -34,6 +34,119 @@ first order (forward or backwards) differences at the boundaries.
 """
 import xarray as xr
 import numpy as np
+from .StreamWriter import StreamWriter
+from .MemoryBudget import get_slab_size
+
+EARTH_RADIUS = 6370000.
+
+def cauchy_green_2d(dxdx, dxdy, dydx, dydy, m11=1., m22=1.):
+    """ Gets the components of the 2D Cauchy Green deformation tensor,
+    :math:`C = J^T M J`, for the whole grid at once.
+
+    Args:
+        - dxdx, dxdy, dydx, dydy (np.array): Jacobian components of the
+        flow map.
+        - m11, m22 (float or np.array, optional): diagonal metric
+        :math:`M`. Identity for cartesian coordinates.
+
+    Returns:
+        - c11, c12, c22 (np.array): independent components of the symmetric
+        tensor.
+
+    """
+    c11 = m11*dxdx*dxdx + m22*dydx*dydx
+    c12 = m11*dxdx*dxdy + m22*dydx*dydy
+    c22 = m11*dxdy*dxdy + m22*dydy*dydy
+    return c11, c12, c22
+
+
+def max_eigval_2d(c11, c12, c22):
+    """ Gets the largest eigenvalue of a field of 2x2 symmetric matrices
+    using the closed-form solution.
+
+    Args:
+        - c11, c12, c22 (np.array): independent components of the symmetric
+        matrices.
+
+    Returns:
+        - eigval (np.array): largest eigenvalue at each grid point.
+
+    """
+    return 0.5*(c11 + c22) + np.hypot(0.5*(c11 - c22), c12)
+
+
+def get_spherical_metric(lat):
+    """ Gets the diagonal metric :math:`M` of the sphere for lon/lat
+    positions, :math:`M = diag(R^2 cos(lat), R^2)`, at the latitudes of the
+    final positions, used by the 2D spherical FTLE.
+
+    Args:
+        - lat (np.array): latitudes in degrees.
+
+    Returns:
+        - m_lon, m_lat (np.array): metric factors of longitude and
+        latitude.
+
+    """
+    R = EARTH_RADIUS
+    m_lon = R*R*np.cos(np.asarray(lat, dtype=float)*np.pi/180.)
+    return m_lon, np.full_like(m_lon, R*R)
+
+
+def get_scale_factors(lat):
+    """ Gets the lon/lat/depth scale factors of the sphere (meters per
+    degree, and 1 for the depth in meters) at the given latitudes.
+
+    Args:
+        - lat (np.array): latitudes in degrees.
+
+    Returns:
+        - S (np.array): scale factors with shape lat.shape + (3,).
+
+    """
+    lat = np.asarray(lat, dtype=float)
+    h_lat = np.full_like(lat, EARTH_RADIUS*np.pi/180.)
+    h_lon = h_lat*np.cos(lat*np.pi/180.)
+    return np.stack([h_lon, h_lat, np.ones_like(lat)], axis=-1)
+
+
+def get_physical_jacobian(J, lat_0, lat_T):
+    """ Turns the jacobian of the lon/lat/depth flow map into meters with
+    the scale factors of the sphere at the initial and final positions,
+    :math:`J_{phys} = S_T J S_0^{-1}` (see get_scale_factors).
+
+    Args:
+        - J (np.array): jacobian with shape (..., 3, 3), rows x, y, z of
+        the final positions and columns x0, y0, z0.
+        - lat_0, lat_T (np.array): initial and final latitudes (degrees)
+        broadcastable to J.shape[:-2].
+
+    Returns:
+        - J_phys (np.array): jacobian in meters per meter.
+
+    """
+    S_T = get_scale_factors(lat_T)
+    S_0 = get_scale_factors(lat_0)
+    return J*S_T[..., :, np.newaxis]/S_0[..., np.newaxis, :]
+
+
+def max_eigval_sym(C):
+    """ Gets the largest eigenvalue of a stack of symmetric matrices with the
+    batched symmetric solver. Matrices with non finite values (land points)
+    return NaN.
+
+    Args:
+        - C (np.array): array with shape (..., n, n).
+
+    Returns:
+        - eigval (np.array): largest eigenvalue with shape (...).
+
+    """
+    valid = np.isfinite(C).all(axis=(-2, -1))
+    C[~valid] = 0.
+    eigval = np.linalg.eigvalsh(C)[..., -1]
+    eigval[~valid] = np.nan
+    return eigval
 
 
 class FTLE:
@@ -46,17 +159,34 @@ class FTLE:
 
     """
 
-    def __init__(self, spherical_flag: bool, integration_time_index: int):
+    def __init__(self, spherical_flag: bool, integration_time_index: int,
+                 engine: str = 'batched', memory_budget_mb: float = 1024.,
+                 explore_stride: int = 1, explore_indices: list = None):
         """Init the object with the setup provided in order to extract ftle.
 
         Args:
             - spherical (bool): True/false. cartesian(false) or spherical(true)
             - integration_time(int): Integer number with the time index of the
-          the last position of the particles.
+          the last position of the particles. A list of time indices computes
+          several integration times (horizons) in one run.
+            - engine (str, optional): "batched" evaluates the deformation
+          tensor over the whole grid at once, "loop" uses the reference
+          point by point computation.
+            - memory_budget_mb (float, optional): working memory (MB) used
+          by the batched engines. The domain (3D) or the time axis (time-scale
+          exploration) is processed in blocks that fit in this budget.
+            - explore_stride (int, optional): time index stride used to
+          explore the time-scale when integration_time_index is "all".
+            - explore_indices (list, optional): time indices used to explore
+          the time-scale. It overrides explore_stride.
         """
 
         self.spherical_flag = bool(spherical_flag)
         self.integration_time = integration_time_index
+        self.engine = engine
+        self.memory_budget_mb = float(memory_budget_mb)
+        self.explore_stride = int(explore_stride)
+        self.explore_indices = explore_indices
 
     def get_integration_time(self, ds: xr.Dataset) -> [float, int]:
         """ Gets the integration in seconds from the integration time index.
@@ -65,21 +195,45 @@ class FTLE:
             - ds (xr.Dataset): dataset with lagrangian simulation.
 
         Returns:
-            - T(float): integration time in seconds
+            - T(float): integration time in seconds (np.array for a list of
+            integration time indices)
             - timeindex(int): integration time index in time dataset axis
+            (list for a list of integration time indices)
 
         """
-        if isinstance(self.integration_time, int):
-            timeindex = self.integration_time
-            T = (ds.time[timeindex]-ds.time[0]).values.astype('timedelta64[s]').astype('f8')
-        if T == 0.0:
-            T = (ds.time[timeindex]-ds.time[0]).values.astype('f8')*1e-9
+        if isinstance(self.integration_time, (int, np.integer)):
+            timeindex = int(self.integration_time)
+            T = self.get_integration_times(ds, [timeindex])[0]
+        elif isinstance(self.integration_time, list):
+            # Several horizons
+            timeindex = [int(i) % ds.time.size for i in self.integration_time]
+            T = self.get_integration_times(ds, timeindex)
         elif isinstance(self.integration_time, float):
             timeindex = -1
             T = self.integration_time
 
         return T, timeindex
 
+    @staticmethod
+    def get_integration_times(ds: xr.Dataset, timeindexes) -> np.array:
+        """ Gets the integration times in seconds of several time indexes.
+
+        Args:
+            - ds (xr.Dataset): dataset with lagrangian simulation.
+            - timeindexes (list): time indexes in time dataset axis.
+
+        Returns:
+            - T(np.array): integration times in seconds
+
+        """
+        time = ds.time.values
+        dt = time[np.asarray(timeindexes, dtype=int)] - time[0]
+        T = dt.astype('timedelta64[s]').astype('f8')
+        # Sub-second outputs
+        subsecond = T == 0.0
+        T[subsecond] = dt[subsecond].astype('timedelta64[ns]').astype('f8')*1e-9
+        return T
+
     def get_ftle_2d_cartesian(self, ds: xr.Dataset) -> np.array:
         """ Gets the 2D FTLE field in cartesian coordinates.
 
@@ -88,6 +242,27 @@ class FTLE:
             finit-time Lyapunov exponents in two-dimensional aperiodic flows.
             Physica D. 212. 271-304. 10.1016/j.physd.2005.10.007.
 
+        The Cauchy Green tensor and its largest eigenvalue are evaluated for
+        the whole grid at once.
+
+        Args:
+            - ds (xr.Dataset): dataset with lagrangian simulation.
+
+        Returns:
+            - ftle (np.array) : 2d dimensional array.
+
+        """
+        T, timeindex = self.get_integration_time(ds)
+        x_T = ds.x.isel(time=timeindex).values.squeeze()
+        y_T = ds.y.isel(time=timeindex).values.squeeze()
+        return self.get_ftle_2d_block(x_T, y_T, ds.y0.values, ds.x0.values,
+                                      T, spherical=False)
+
+    def get_ftle_2d_cartesian_loop(self, ds: xr.Dataset) -> np.array:
+        """ Gets the 2D FTLE field in cartesian coordinates point by point.
+
+        Reference implementation of get_ftle_2d_cartesian.
+
         Args:
             - ds (xr.Dataset): dataset with lagrangian simulation.
 
@@ -115,6 +290,56 @@ class FTLE:
     def get_ftle_2d_spherical(self, ds: xr.Dataset) -> np.array:
         """ Gets the 2D FTLE field in in lat - lon coordinates.
 
+        The metric factors are computed once as arrays and the tensor
+        :math:`C = J^T M J` is evaluated for the whole grid at once.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset with lagrangian
+            simulation.
+
+        Returns:
+            - ftle (np.array) : 2d dimensional array.
+
+        """
+        T, timeindex = self.get_integration_time(ds)
+        x_T = ds.x.isel(time=timeindex).values.squeeze()
+        y_T = ds.y.isel(time=timeindex).values.squeeze()
+        return self.get_ftle_2d_block(x_T, y_T, ds.y0.values, ds.x0.values,
+                                      T, spherical=True)
+
+    def get_ftle_2d_block(self, x_T: np.array, y_T: np.array, y0: np.array,
+                          x0: np.array, T, spherical: bool) -> np.array:
+        """ Batched 2D FTLE engine.
+
+        Args:
+            - x_T, y_T (np.array): final positions with shape (..., ny, nx).
+            Leading dimensions (time blocks) are processed at once.
+            - y0, x0 (np.array): initial grid coordinates.
+            - T (float or np.array): integration time/s in seconds, one per
+            leading index.
+            - spherical (bool): x, y are given in degrees.
+
+        Returns:
+            - ftle (np.array) : array with the shape of x_T.
+
+        """
+        dxdy, dxdx = np.gradient(x_T, y0, x0, axis=(-2, -1))
+        dydy, dydx = np.gradient(y_T, y0, x0, axis=(-2, -1))
+        if spherical:
+            m11, m22 = get_spherical_metric(y_T)
+        else:
+            m11, m22 = 1., 1.
+        c11, c12, c22 = cauchy_green_2d(dxdx, dxdy, dydx, dydy, m11, m22)
+        eig_lya = max_eigval_2d(c11, c12, c22)
+        T = np.reshape(T, np.shape(T) + (1, 1))
+        ftle = (1./np.abs(T))*np.log(np.sqrt(eig_lya))
+        return ftle
+
+    def get_ftle_2d_spherical_loop(self, ds: xr.Dataset) -> np.array:
+        """ Gets the 2D FTLE field in in lat - lon coordinates point by point.
+
+        Reference implementation of get_ftle_2d_spherical.
+
         Args:
             - ds (xr.Dataset): grid structured dataset with lagrangian
             simulation.
@@ -124,20 +349,18 @@ class FTLE:
 
         """
         T, timeindex = self.get_integration_time(ds)
-        R = 6370000.
         x_T = ds.x.isel(time=timeindex).values.squeeze()
         y_T = ds.y.isel(time=timeindex).values.squeeze()
         dxdy, dxdx = np.gradient(x_T, ds.y0, ds.x0)
         dydy, dydx = np.gradient(y_T, ds.y0, ds.x0)
         ny, nx = np.shape(dxdx)
         ftle = np.zeros([ny, nx])
-        theta = ds.y.isel(time=timeindex).squeeze().values
+        m_lon, m_lat = get_spherical_metric(y_T)
         for i in range(0, ny):
             for j in range(0, nx):
                 J = np.array([[dxdx[i, j], dxdy[i, j]],
                               [dydx[i, j], dydy[i, j]]])
-                M = np.array(
-                    [[R*R*np.cos(theta[i, j]*np.pi/180.), 0], [0., R*R]])
+                M = np.diag([m_lon[i, j], m_lat[i, j]])
                 C = np.dot(np.dot(np.transpose(J), M), J)
                 eig_lya, _ = np.linalg.eigh(C)
                 ftle[i, j] = (1./np.abs(T))*np.log(np.sqrt(eig_lya.max()))
@@ -153,6 +376,132 @@ class FTLE:
         Returns:
             - ftle (np.array) : 3d dimensional array.
 
+        """
+        return self.get_ftle_3d(ds, spherical=False)
+
+    def get_ftle_3d_spherical(self, ds: xr.Dataset) -> np.array:
+        """ Gets the 3D FTLE field in lon - lat - depth coordinates.
+
+        The jacobian of the lon/lat/depth flow map is turned into meters
+        with the scale factors of the sphere at the initial and final
+        positions (get_physical_jacobian), so the horizontal and vertical
+        deformations (e.g. a vertical shear) are in the same units.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset with lagrangian
+            simulation.
+
+        Returns:
+            - ftle (np.array) : 3d dimensional array.
+
+        """
+        return self.get_ftle_3d(ds, spherical=True)
+
+    def get_ftle_3d(self, ds: xr.Dataset, spherical: bool) -> np.array:
+        """ Gets the 3D FTLE field with the batched engine.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset with lagrangian
+            simulation.
+            - spherical (bool): x, y are given in degrees.
+
+        Returns:
+            - ftle (np.array) : 3d dimensional array.
+
+        """
+        T, timeindex = self.get_integration_time(ds)
+        r_T = [ds.x.isel(time=timeindex).values.squeeze(),
+               ds.y.isel(time=timeindex).values.squeeze(),
+               ds.z.isel(time=timeindex).values.squeeze()]
+        return self.get_ftle_3d_block(r_T, ds.z0.values, ds.y0.values,
+                                      ds.x0.values, T, spherical)
+
+    def get_ftle_3d_block(self, r_T: list, z0: np.array, y0: np.array,
+                          x0: np.array, T: float, spherical: bool) -> np.array:
+        """ Batched 3D FTLE engine for one integration time.
+
+        The Cauchy Green tensors are stacked in (nz, ny, nx, 3, 3) blocks and
+        solved with the batched symmetric eigenvalue solver. The domain is
+        processed by z-slabs (with one extra layer on each side for the
+        gradient stencil) so the working memory stays within memory_budget_mb.
+
+        Args:
+            - r_T (list): final positions [x_T, y_T, z_T] with shape
+            (nz, ny, nx).
+            - z0, y0, x0 (np.array): initial grid coordinates.
+            - T (float): integration time in seconds.
+            - spherical (bool): x, y are given in degrees.
+
+        Returns:
+            - ftle (np.array) : 3d dimensional array.
+
+        """
+        nz, ny, nx = r_T[0].shape
+        ftle = np.zeros([nz, ny, nx])
+
+        # J, C and the solver workspace: ~40 doubles per grid point.
+        nslabs = get_slab_size(self.memory_budget_mb, ny*nx, 40*8)
+        for k0 in range(0, nz, nslabs):
+            k1 = min(k0 + nslabs, nz)
+            lo, hi = max(k0 - 1, 0), min(k1 + 1, nz)
+            J = np.zeros([hi - lo, ny, nx, 3, 3])
+            for row in range(0, 3):
+                drdz, drdy, drdx = np.gradient(r_T[row][lo:hi], z0[lo:hi],
+                                               y0, x0)
+                J[..., row, 0] = drdx
+                J[..., row, 1] = drdy
+                J[..., row, 2] = drdz
+            J = J[k0 - lo:k1 - lo]
+            if spherical:
+                J = get_physical_jacobian(J, y0[np.newaxis, :, np.newaxis],
+                                          r_T[1][k0:k1])
+            C = np.matmul(np.swapaxes(J, -1, -2), J)
+            eig_lya = max_eigval_sym(C)
+            ftle[k0:k1] = (1./np.abs(T))*np.log(np.sqrt(eig_lya))
+        return ftle
+
+    def get_ftle_3d_cartesian_loop(self, ds: xr.Dataset) -> np.array:
+        """ Gets the 3D FTLE field in cartesian coordinates point by point.
+
+        Reference implementation of get_ftle_3d_cartesian.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset with lagrangian
+            simulation.
+
+        Returns:
+            - ftle (np.array) : 3d dimensional array.
+
+        """
+        return self.get_ftle_3d_loop(ds, spherical=False)
+
+    def get_ftle_3d_spherical_loop(self, ds: xr.Dataset) -> np.array:
+        """ Gets the 3D FTLE field in lon - lat - depth coordinates point by
+        point.
+
+        Reference implementation of get_ftle_3d_spherical.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset with lagrangian
+            simulation.
+
+        Returns:
+            - ftle (np.array) : 3d dimensional array.
+
+        """
+        return self.get_ftle_3d_loop(ds, spherical=True)
+
+    def get_ftle_3d_loop(self, ds: xr.Dataset, spherical: bool) -> np.array:
+        """ Gets the 3D FTLE field point by point.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset with lagrangian
+            simulation.
+            - spherical (bool): x, y are given in degrees.
+
+        Returns:
+            - ftle (np.array) : 3d dimensional array.
+
         """
         T, timeindex = self.get_integration_time(ds)
         x_T = ds.x.isel(time=timeindex).values.squeeze()
@@ -160,7 +509,7 @@ class FTLE:
         z_T = ds.z.isel(time=timeindex).values.squeeze()
         dxdz, dxdy, dxdx = np.gradient(x_T, ds.z0, ds.y0, ds.x0)
         dydz, dydy, dydx = np.gradient(y_T, ds.z0, ds.y0, ds.x0)
-        dzdx, dzdy, dzdz = np.gradient(z_T, ds.z0, ds.y0, ds.x0)
+        dzdz, dzdy, dzdx = np.gradient(z_T, ds.z0, ds.y0, ds.x0)
         nz, ny, nx = dxdz.shape
         ftle = np.zeros([nz, ny, nx])
         J = np.zeros([3, 3])
@@ -170,15 +519,31 @@ class FTLE:
                     J = np.array([[dxdx[i, j, k], dxdy[i, j, k], dxdz[i, j, k]],
                                   [dydx[i, j, k], dydy[i, j, k], dydz[i, j, k]],
                                   [dzdx[i, j, k], dzdy[i, j, k], dzdz[i, j, k]]])
+                    if not np.all(np.isfinite(J)):
+                        ftle[i, j, k] = np.nan
+                        continue
+                    if spherical:
+                        S_0 = get_scale_factors(ds.y0.values[j])
+                        S_T = get_scale_factors(y_T[i, j, k])
+                        J = np.dot(np.dot(np.diag(S_T), J),
+                                   np.diag(1./S_0))
                     C = np.dot(np.transpose(J), J)
-                    eig_lya, _ = np.linalg.eig(C)
+                    eig_lya = np.linalg.eigvalsh(C)
                     ftle[i, j, k] = (1./np.abs(T))*np.log(np.sqrt(eig_lya.max()))
 
         return ftle
 
+    @staticmethod
+    def check_3d_data(ds: xr.Dataset) -> bool:
+        """ Check if the initial grid of a dataset is 3D. """
+        return hasattr(ds, 'z0') & (ds.z0.size > 1)
+
     def to_dataset(self, ds: xr.Dataset, ftle: np.array) -> xr.Dataset:
         """ writes the ftle field in the dataset.
 
+        For several integration times the field has an extra
+        integration_time dimension (seconds).
+
         Args:
             - ds (xr.Dataset): grid structured dataset with lagrangian
             simulation.
@@ -189,10 +554,19 @@ class FTLE:
 
         """
         T, timeindex = self.get_integration_time(ds)
+        if isinstance(timeindex, list):
+            ds.coords['integration_time'] = ('integration_time', T,
+                                             {'units': 's'})
+            ds.coords['integration_time_index'] = ('integration_time',
+                                                   timeindex)
+            dims = ('integration_time',) + ds.x.isel(time=0).dims
+            T = T[np.argmax(np.abs(T))]
+        else:
+            dims = ds.x.isel(time=timeindex).dims
         if T > 0:
-            ds['FTLE_forward'] = (ds.x.isel(time=timeindex).dims, ftle)
+            ds['FTLE_forward'] = (dims, ftle)
         if T < 0:
-            ds['FTLE_backward'] = (ds.x.isel(time=timeindex).dims, ftle)
+            ds['FTLE_backward'] = (dims, ftle)
         return ds
 
     def get_ftle(self, ds: xr.Dataset, to_dataset=True):
@@ -217,46 +591,230 @@ class FTLE:
         print('-> FTLE  >> t0 (starting time): ', t0)
         print('-> FTLE  >> T (advection time): ', T, 's')
 
-        flag_3d = hasattr(ds, 'z0') & (ds.z0.size > 1)
-
-        if (self.spherical_flag is False) and (flag_3d is False):
-            ftle = self.get_ftle_2d_cartesian(ds)
+        flag_3d = self.check_3d_data(ds)
+
+        if ds.x.chunks is not None:
+            ftle = self.get_ftle_lazy(ds)
+        elif isinstance(self.integration_time, list):
+            ftle = self.get_ftle_horizons(ds)
+        elif (self.spherical_flag is False) and (flag_3d is False):
+            if self.engine == 'loop':
+                ftle = self.get_ftle_2d_cartesian_loop(ds)
+            else:
+                ftle = self.get_ftle_2d_cartesian(ds)
         elif (self.spherical_flag is True) and (flag_3d is False):
-            ftle = self.get_ftle_2d_spherical(ds)
+            if self.engine == 'loop':
+                ftle = self.get_ftle_2d_spherical_loop(ds)
+            else:
+                ftle = self.get_ftle_2d_spherical(ds)
         elif (self.spherical_flag is False) and (flag_3d is True):
-            ftle = self.get_ftle_3d_cartesian(ds)
+            if self.engine == 'loop':
+                ftle = self.get_ftle_3d_cartesian_loop(ds)
+            else:
+                ftle = self.get_ftle_3d_cartesian(ds)
         elif((self.spherical_flag is True) and (flag_3d is True)):
-            print('-> No spherical 3D FTLE available at the moment')
-            print('-> Choose cartersian-2d or spherical_2d or 3d')
-            return
+            if self.engine == 'loop':
+                ftle = self.get_ftle_3d_spherical_loop(ds)
+            else:
+                ftle = self.get_ftle_3d_spherical(ds)
 
         if to_dataset is True:
             self.to_dataset(ds, ftle)
 
         return ftle
 
-    def explore_ftle_timescale(self, ds: xr.Dataset) -> xr.Dataset:
+    def get_time_block_size(self, ds: xr.Dataset) -> int:
+        """ Gets the number of time indices processed at once by
+        get_ftle_indices within memory_budget_mb.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset.
+
+        Returns:
+            - block (int): number of time indices per block.
+
+        """
+        if self.check_3d_data(ds):
+            return 1
+        # positions, gradients and tensor: ~16 doubles per grid point.
+        return get_slab_size(self.memory_budget_mb, ds.x.isel(time=0).size,
+                             16*8)
+
+    def get_ftle_indices(self, ds: xr.Dataset, indices: list,
+                         T: np.array) -> np.array:
+        """ Gets the FTLE fields of several integration time indices in one
+        batched pass.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset.
+            - indices (list): integration time indices.
+            - T (np.array): integration times in seconds of the indices.
+
+        Returns:
+            - ftle (np.array): array with shape (len(indices), [nz], ny, nx).
+
+        """
+        y0, x0 = ds.y0.values, ds.x0.values
+        if self.check_3d_data(ds):
+            ftle = []
+            for timeindex, T_i in zip(indices, T):
+                r_T = [ds[var].isel(time=timeindex).values
+                       for var in ['x', 'y', 'z']]
+                ftle.append(self.get_ftle_3d_block(
+                    r_T, ds.z0.values, y0, x0, T_i, self.spherical_flag))
+            return np.stack(ftle)
+        x_T = ds.x.isel(time=indices).values
+        y_T = ds.y.isel(time=indices).values
+        return self.get_ftle_2d_block(x_T, y_T, y0, x0, T,
+                                      self.spherical_flag)
+
+    def get_ftle_horizons(self, ds: xr.Dataset) -> np.array:
+        """ Gets the FTLE for several integration times (horizons) from the
+        same gridded dataset.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset.
+
+        Returns:
+            - ftle (np.array): array with shape (n_horizons, [nz], ny, nx).
+
+        """
+        T, indices = self.get_integration_time(ds)
+        block = self.get_time_block_size(ds)
+        ftle = [self.get_ftle_indices(ds, indices[b0:b0 + block],
+                                      T[b0:b0 + block])
+                for b0 in range(0, len(indices), block)]
+        return np.concatenate(ftle)
+
+    def get_ftle_lazy(self, ds: xr.Dataset):
+        """ Gets the FTLE as a lazy dask array for a dataset opened with
+        chunks.
+
+        The batched engines are mapped over spatial blocks of the final
+        positions with an overlap of one point (gradient stencil) that is
+        trimmed afterwards, so the result is the same as the eager one (up
+        to rounding) and the blocks are evaluated in parallel when the field
+        is computed or written.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset with dask arrays.
+
+        Returns:
+            - ftle (dask.array): lazy FTLE field ([n_horizons], [nz], ny, nx).
+
+        """
+        import dask.array as da
+
+        T, timeindex = self.get_integration_time(ds)
+        flag_3d = self.check_3d_data(ds)
+        labels = ['x', 'y', 'z'] if flag_3d else ['x', 'y']
+        coords = ['z0', 'y0', 'x0'] if flag_3d else ['y0', 'x0']
+        positions = ds.x.isel(time=0).data
+        shape = positions.shape
+        # Spatial blocks: the dataset chunks or slabs within the budget.
+        if positions.npartitions == 1:
+            slab = get_slab_size(self.memory_budget_mb, np.prod(shape[1:]),
+                                 40*8)
+            positions = positions.rechunk({0: slab})
+        chunks = positions.chunks
+
+        # Initial coordinates broadcast to the grid with the same blocks.
+        grid_coords = []
+        for axis, coord in enumerate(coords):
+            values = np.reshape(ds[coord].values,
+                                [-1 if i == axis else 1
+                                 for i in range(len(shape))])
+            grid_coords.append(da.broadcast_to(values, shape).rechunk(chunks))
+
+        def ftle_block(*arrays, T):
+            r_T = arrays[:len(labels)]
+            r_0 = [np.moveaxis(r, axis, 0)[(slice(None),) +
+                                            (0,)*(len(shape) - 1)]
+                   for axis, r in enumerate(arrays[len(labels):])]
+            if flag_3d:
+                return self.get_ftle_3d_block(list(r_T), *r_0, T,
+                                              self.spherical_flag)
+            return self.get_ftle_2d_block(*r_T, *r_0, T, self.spherical_flag)
+
+        ftle = []
+        for T_i, index in zip(np.atleast_1d(T), np.atleast_1d(timeindex)):
+            r_T = [ds[var].isel(time=index).data.rechunk(chunks)
+                   for var in labels]
+            ftle.append(da.map_overlap(ftle_block, *r_T, *grid_coords,
+                                       T=T_i, depth=1, boundary='none',
+                                       dtype=float, trim=True))
+        if isinstance(timeindex, list):
+            return da.stack(ftle)
+        return ftle[0]
+
+    def get_explore_indices(self, ds: xr.Dataset) -> list:
+        """ Gets the time indices used to explore the time-scale.
+
+        Args:
+            - ds (xr.Dataset): grid structured dataset.
+
+        Returns:
+            - indices (list): time indices, all of them, a strided subset
+            (explore_stride) or a listed subset (explore_indices).
+
+        """
+        nsteps = ds.time.size
+        if self.explore_indices is not None:
+            return [int(i) % nsteps for i in self.explore_indices]
+        return list(range(0, nsteps, self.explore_stride))
+
+    def explore_ftle_timescale(self, ds: xr.Dataset,
+                               output_file: str = None) -> xr.Dataset:
         """
         It computes the FTLE for all timesteps instead of a given one.
         The output produced will help you to explore the timescale of the
         deformation in order to infer the attributes for LCS and FTLE
         computation.
 
+        The gradients and the Cauchy Green tensors are computed in batched
+        passes over blocks of time indices sized with memory_budget_mb. If
+        an output file is provided, each block is written as soon as it is
+        finished and the FTLE is not kept in memory.
 
         Args:
             - ds (xr.Dataset): grid structured dataset with ftle field
+            - output_file (str, optional): netCDF file to write the FTLE
+            block by block.
 
         Returns:
-            - ds (xr.Dataset) ds_output with FTLE computed for all timesteps.
+            - ds (xr.Dataset) ds_output with FTLE computed for the explored
+            timesteps (without FTLE if it was written to output_file).
 
         """
         print('-> FTLE >> Exploring time-scale T (advection time)')
-        ftle = np.zeros_like(ds.x.values)
-        nsteps = ds.time.size
-
-        for i in range(0, nsteps):
-            self.integration_time = i
-            ftle[i] = self.get_ftle(ds, to_dataset=False)
-            print('-> FTLE  >> ' + 'time index: ' + str(i) + '/' + str(nsteps) + '\r')
-        ds['FTLE'] = (ds.x.dims, ftle)
-        return ds
+        indices = self.get_explore_indices(ds)
+        T = self.get_integration_times(ds, indices)
+        nsteps = len(indices)
+        dims = ds.x.dims
+        shape = [nsteps] + list(ds.x.shape[1:])
+
+        ds_output = ds.coords.to_dataset().isel(time=indices)
+        ds_output['integration_time'] = ('time', T, {'units': 's'})
+
+        if output_file is not None:
+            writer = StreamWriter(output_file)
+            writer.create(ds_output)
+            writer.add_variable('FTLE', dims)
+        else:
+            ftle = np.zeros(shape)
+
+        block = self.get_time_block_size(ds)
+        for b0 in range(0, nsteps, block):
+            b1 = min(b0 + block, nsteps)
+            ftle_block = self.get_ftle_indices(ds, indices[b0:b1], T[b0:b1])
+            if output_file is not None:
+                writer.write('FTLE', ftle_block, (slice(b0, b1),))
+            else:
+                ftle[b0:b1] = ftle_block
+            print('-> FTLE  >> ' + 'time index: ' + str(b1) + '/' + str(nsteps) + '\r')
+
+        if output_file is not None:
+            writer.close()
+        else:
+            ds_output['FTLE'] = (dims, ftle)
+        return ds_output
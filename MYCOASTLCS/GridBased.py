@@ -1,13 +1,151 @@
 # -*- coding: utf-8 -*-
 """ Module to create cell-grids. A cell-grid is a domain division into cells to
 perform operations with particles on cell volumes/areas done by cell centers 
-and cell edges."""
-
+and cell edges.
+
+The grid based measures derive their statistics from the flat cell index of
+every (time, particle) position (see GridBased.get_cell_index). With
+CellIndex the index is computed once per bins configuration and shared by
+all the measures with the same bins, so each measure is a reduction of the
+index instead of another binning of the positions.
+
+GridBased is an abstract base class: every measure implements the
+accumulator of the streamed computation (accumulate, discard and
+get_stream_output)."""
+
+import abc
+import hashlib
+import os
+import tempfile
 import numpy as np
 import xarray as xr
 
 
-class GridBased:
+def get_axis_index(edges: np.array, values: np.array) -> np.array:
+    """
+    Cell index of the values along one axis, with the np.histogramdd
+    convention: edges[i] <= value < edges[i+1], and the last edge belongs
+    to the last cell.
+
+    For uniform edges the index is computed arithmetically and corrected
+    by one cell where the rounding puts a value on the wrong side of an
+    edge. Non-uniform edges use np.searchsorted.
+
+    Args:
+        edges (np.array): monotonically increasing cell edges.
+        values (np.array): positions.
+
+    Returns:
+        index (np.array): cell index (int64), -1 outside the edges or NaN.
+
+    """
+    n = edges.size - 1
+    delta = np.diff(edges)
+    if np.any(delta < 0):
+        raise ValueError('bins must be monotonically increasing')
+    shape = np.shape(values)
+    values = np.ravel(values)
+    valid = (values >= edges[0]) & (values <= edges[-1])
+    if (delta[0] > 0) and np.allclose(delta, delta[0], rtol=1e-9, atol=0):
+        scaled = values - edges[0]
+        scaled *= n/(edges[-1] - edges[0])
+        with np.errstate(invalid='ignore'):
+            index = scaled.astype(np.int64)
+        # Only the values next to an edge can be rounded to the wrong cell
+        scaled -= index
+        near = np.flatnonzero(((scaled < 1e-6) | (scaled > 1 - 1e-6)) & valid)
+        near_index = np.minimum(index[near], n - 1)
+        near_values = values[near]
+        near_index -= near_values < edges[near_index]
+        near_index += (near_values >= edges[near_index + 1]) & \
+            (near_index < n - 1)
+        index[near] = near_index
+    else:
+        index = np.searchsorted(edges, values, side='right') - 1
+        index[values == edges[-1]] = n - 1
+    np.putmask(index, ~valid, -1)
+    return index.reshape(shape)
+
+
+class CellIndex:
+
+    def __init__(self, memmap_dir: str = None):
+        """
+        Cache of the flat cell index [time, particle] of the positions of a
+        dataset, by bins configuration. The index is stored as int32 (int64
+        for grids with more than 2**31 cells).
+
+        Args:
+            memmap_dir (str, optional): folder to keep the indices in
+            memory-mapped temporary files instead of in memory.
+
+        Returns:
+            None.
+
+        """
+        self.memmap_dir = memmap_dir
+        self.index = {}
+        self.files = []
+
+    def allocate(self, shape: tuple, dtype) -> np.array:
+        """ Empty index array, in memory or memory-mapped. """
+        if self.memmap_dir is None:
+            return np.empty(shape, dtype=dtype)
+        os.makedirs(self.memmap_dir, exist_ok=True)
+        fd, filename = tempfile.mkstemp(suffix='.npy', dir=self.memmap_dir)
+        os.close(fd)
+        self.files.append(filename)
+        return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                         shape=shape)
+
+    def get_index(self, measure, ds: xr.Dataset) -> np.array:
+        """
+        Cell index of the positions of a dataset in the bins of a measure.
+        It is computed the first time, by blocks of timesteps, and reused
+        by the measures with the same bins.
+
+        Args:
+            measure (GridBased): measure with initialized bins.
+            ds (xr.Dataset): Input dataset with particle positions.
+
+        Returns:
+            index (np.array): flat cell index [time, particle], -1 for the
+            positions outside the grid or NaN.
+
+        """
+        key = measure.get_bins_hash()
+        if key in self.index:
+            print('-> ' + measure.abbrev, '>> Reusing the cell index')
+            return self.index[key]
+
+        print('-> ' + measure.abbrev, '>> Computing the cell index')
+        n_cells = int(np.prod([edges.size - 1 for edges in measure.bins]))
+        dtype = np.int32 if n_cells < 2**31 - 1 else np.int64
+
+        def index_block(z, y, x):
+            nt = z.shape[0]
+            return measure.get_cell_index(z.reshape(nt, -1),
+                                          y.reshape(nt, -1),
+                                          x.reshape(nt, -1)).astype(dtype)
+
+        blocks = measure.apply_by_blocks(index_block, ds, 'time')
+        index = self.allocate((ds.time.size, blocks[0].shape[1]), dtype)
+        i0 = 0
+        for block in blocks:
+            index[i0:i0 + block.shape[0]] = block
+            i0 += block.shape[0]
+        self.index[key] = index
+        return index
+
+    def close(self):
+        """ Release the indices and remove the memory-mapped files. """
+        self.index = {}
+        for filename in self.files:
+            os.remove(filename)
+        self.files = []
+
+
+class GridBased(abc.ABC):
 
     def __init__(self, nbins: int or list, bins_option: str, static):
         """
@@ -34,7 +172,7 @@ class GridBased:
         self.dims = ['time', 'z_c', 'y_c', 'x_c']
         self.static = static
 
-    def get_bins(self, ds: xr.Dataset):
+    def get_bins(self, ds: xr.Dataset, geometry=None):
         """
         Gets the bins from an input xr.Dataset.
 
@@ -48,15 +186,25 @@ class GridBased:
             - "custom": It uses custom user domain limits to apply the "nbins"
             binning.
 
+        The "origin" and "custom" bins only depend on the seeding grid and
+        the setup, so they are reused from the grid geometry if any.
+
         Args:
             ds (xr.Dataset): DESCRIPTION.
+            geometry (GridGeometry, optional): cached grid geometry.
 
         Returns:
             None.
 
         """
+        bins_key = None
+        if (geometry is not None) and (self.bins_option != 'domain'):
+            bins_key = geometry.get_bins_key(self.bins_option, self.nbins)
 
-        if self.bins_option == 'origin':
+        if (bins_key is not None) and (bins_key in geometry.bins):
+            z_bins, y_bins, x_bins = geometry.bins[bins_key]
+
+        elif self.bins_option == 'origin':
             if self.nbins:
                 x_bins = np.linspace(ds.x0.min(), ds.x0.max(), self.nbins)
                 y_bins = np.linspace(ds.y0.min(), ds.y0.max(), self.nbins)
@@ -89,6 +237,9 @@ class GridBased:
             y_bins = np.linspace(*self.nbins[1])
             x_bins = np.linspace(*self.nbins[2])
 
+        if (bins_key is not None) and (bins_key not in geometry.bins):
+            geometry.set_bins(bins_key, (z_bins, y_bins, x_bins))
+
         if (z_bins.size > 1) and (self.static is False):
             self.bins = (z_bins, y_bins, x_bins)
         elif (z_bins.size <= 1) and (self.static is False):
@@ -121,6 +272,74 @@ class GridBased:
         flag_2d = np.all(np.abs(ds.z.isel(time=-1) - ds.z.isel(time=0)) < 1e-6)
         return flag_2d
 
+    @staticmethod
+    def apply_by_blocks(func, ds: xr.Dataset, dim: str) -> list:
+        """
+        Apply a function to the (z, y, x) positions block by block along a
+        dimension. For datasets opened lazily (dask) the blocks are the
+        chunks of the dataset and they are computed in parallel. Otherwise
+        the whole dataset is a single block.
+
+        Args:
+            func (function): function of the (z, y, x) arrays of a block.
+            ds (xr.Dataset): Input dataset with particle positions.
+            dim (str): Dimension to split in blocks.
+
+        Returns:
+            list: results of func for each block.
+
+        """
+        axis = ds.x.dims.index(dim)
+        if ds.x.chunks is None:
+            edges = [0, ds.x.shape[axis]]
+        else:
+            edges = np.cumsum((0,) + ds.x.chunks[axis])
+
+        blocks = []
+        for start, stop in zip(edges[:-1], edges[1:]):
+            index = (slice(None),)*axis + (slice(start, stop),)
+            blocks.append([ds[var].data[index] for var in ['z', 'y', 'x']])
+
+        if ds.x.chunks is None:
+            return [func(*block) for block in blocks]
+
+        import dask
+        return dask.compute(*[dask.delayed(func)(*block)
+                              for block in blocks])
+
+    def get_cell_index(self, z: np.array, y: np.array,
+                       x: np.array) -> np.array:
+        """
+        Flat index of the cell of each position in the bins grid (z, y, x
+        or y, x cells in C order).
+
+        Args:
+            z, y, x (np.array): Particle positions.
+
+        Returns:
+            index (np.array): flat cell index (int64). -1 for the positions
+            outside the grid or NaN.
+
+        """
+        positions = [z, y, x][-len(self.bins):]
+        index = np.zeros(np.shape(x), dtype=np.int64)
+        valid = np.ones(np.shape(x), dtype=bool)
+        for edges, values in zip(self.bins, positions):
+            axis_index = get_axis_index(edges, np.asarray(values))
+            valid &= axis_index >= 0
+            index *= edges.size - 1
+            index += axis_index
+        np.putmask(index, ~valid, -1)
+        return index
+
+    def get_bins_hash(self) -> str:
+        """ Hash of the cell edges, to share the cell index (CellIndex). """
+        key = hashlib.sha1()
+        for edges in self.bins:
+            key.update(np.ascontiguousarray(edges, dtype='f8').tobytes())
+            key.update(b'|')
+        return key.hexdigest()
+
     def get_centers(self):
         """
         Get the center point based on bins defining each cell.
@@ -152,21 +371,86 @@ class GridBased:
                   self.bins[0].max(), ',',
                   self.bins[0].size, ']')
 
-    def init_grid(self, ds_input: xr.Dataset):
+    def init_grid(self, ds_input: xr.Dataset, geometry=None):
         """
         Initialize the grid from a provided dataset.
 
         Args:
             ds_input (xr.Dataset): Input dataset.
+            geometry (GridGeometry, optional): cached grid geometry.
 
         Returns:
             None.
 
         """
-        self.get_bins(ds_input)
+        self.get_bins(ds_input, geometry)
         self.get_centers()
         self.print_bins_info()
 
+    def init_stream(self, ds_input: xr.Dataset, geometry=None):
+        """
+        Initialize the grid and the accumulator of a time-chunked (streamed)
+        computation. The cell index of the positions is then passed chunk
+        by chunk to accumulate and the result is obtained with
+        get_stream_output.
+
+        Args:
+            ds_input (xr.Dataset): Dataset with the grid coordinates (and
+            the extent of the positions for the "domain" bins).
+            geometry (GridGeometry, optional): cached grid geometry.
+
+        Returns:
+            None.
+
+        """
+        self.init_grid(ds_input, geometry)
+
+    @abc.abstractmethod
+    def accumulate(self, index: np.array, particles: slice, steps: slice):
+        """
+        Accumulate a chunk of positions. See init_stream.
+
+        Args:
+            index (np.array): flat cell index [time, particle] of the
+            positions (see get_cell_index).
+            particles (slice): particles of the chunk in the input file.
+            steps (slice): timesteps of the chunk in the input file.
+
+        Returns:
+            None.
+
+        """
+
+    @abc.abstractmethod
+    def discard(self, index: np.array, n_steps: int = None):
+        """
+        Remove particles from the accumulated chunks. See init_stream.
+
+        Args:
+            index (np.array): flat cell index [time, particle] of the
+            positions of the particles at all the timesteps, or [1,
+            particle] for particles that stayed in the same cell.
+            n_steps (int, optional): timesteps of the particles that stayed
+            in the same cell.
+
+        Returns:
+            None.
+
+        """
+
+    @abc.abstractmethod
+    def get_stream_output(self, ds_input: xr.Dataset) -> xr.Dataset:
+        """
+        Output dataset of the accumulated chunks. See init_stream.
+
+        Args:
+            ds_input (xr.Dataset): Dataset with the grid coordinates.
+
+        Returns:
+            ds_output (xr.Dataset): Output dataset of the measure.
+
+        """
+
     def init_dataset(self, ds_input):
         if self.bins_option == 'origin':
             ds_output = xr.Dataset({})
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+""" GridGeometry module. It keeps the geometry derived from the seeding grid
+of the particles, so the files of a run (and later runs) sharing the same
+seeding grid reuse it instead of rebuilding it:
+
+    - x0, y0, z0: initial grid coordinates.
+    - bins: cell edges of the "origin" and "custom" binning options.
+
+The geometry is identified by a hash of the initial positions and the
+grid_shape. It is held in memory and, optionally, in a .npz sidecar file.
+
+Only what depends on the initial positions is kept. The land mask depends on
+the trajectories (e.g. beaching differs between files or between the forward
+and backward runs of a pair), so it is obtained for each dataset.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+import xarray as xr
+
+_GEOMETRY_CACHE = {}
+
+
+def get_geometry_key(ds: xr.Dataset, grid_shape: list) -> str:
+    """
+    Hash of the initial positions and the grid shape.
+
+    Args:
+        ds (xr.Dataset): Lagrangian dataset [time, particle].
+        grid_shape (list): grid of shape of points [nz, ny, nx].
+
+    Returns:
+        key (str): hexadecimal hash.
+
+    """
+    key = hashlib.sha1(json.dumps(list(grid_shape)).encode())
+    for var in ['x', 'y', 'z']:
+        r0 = np.ascontiguousarray(ds[var].isel(time=0).values, dtype='f8')
+        key.update(r0.tobytes())
+    return key.hexdigest()
+
+
+def get_grid_geometry(ds: xr.Dataset, grid_shape: list,
+                      sidecar: str = None):
+    """
+    Grid geometry of a dataset: from memory, from the sidecar file or a new
+    empty one.
+
+    Args:
+        ds (xr.Dataset): Lagrangian dataset [time, particle].
+        grid_shape (list): grid of shape of points [nz, ny, nx].
+        sidecar (str, optional): .npz file to load/save the geometry.
+
+    Returns:
+        geometry (GridGeometry): grid geometry.
+
+    """
+    key = get_geometry_key(ds, grid_shape)
+    if key in _GEOMETRY_CACHE:
+        print('-> GEOM  >> Reusing grid geometry', key[:12])
+        geometry = _GEOMETRY_CACHE[key]
+    else:
+        geometry = GridGeometry(key, sidecar)
+        if geometry.load() is True:
+            print('-> GEOM  >> Grid geometry read from', sidecar)
+        _GEOMETRY_CACHE[key] = geometry
+    geometry.sidecar = sidecar
+    return geometry
+
+
+class GridGeometry:
+
+    def __init__(self, key: str, sidecar: str = None):
+        """
+        Grid geometry initializer.
+
+        Args:
+            key (str): hash of the initial positions and the grid shape.
+            sidecar (str, optional): .npz file to load/save the geometry.
+
+        Returns:
+            None.
+
+        """
+        self.key = key
+        self.sidecar = sidecar
+        self.coords = None
+        self.bins = {}
+        self.modified = False
+
+    @staticmethod
+    def get_bins_key(bins_option: str, nbins) -> str:
+        """ Key of a binning configuration. """
+        return bins_option + ':' + json.dumps(nbins)
+
+    def set_coords(self, z0: np.array, y0: np.array, x0: np.array):
+        """ Store the initial grid coordinates. """
+        self.coords = (z0, y0, x0)
+        self.modified = True
+
+    def set_bins(self, bins_key: str, bins: tuple):
+        """ Store the (z, y, x) bins of a binning configuration. """
+        self.bins[bins_key] = bins
+        self.modified = True
+
+    def load(self) -> bool:
+        """
+        Read the geometry from the sidecar file if it matches the key.
+
+        Returns:
+            bool: True if the geometry was read.
+
+        """
+        if (self.sidecar is None) or (not os.path.exists(self.sidecar)):
+            return False
+        with np.load(self.sidecar) as data:
+            if str(data['key']) != self.key:
+                return False
+            if 'x0' in data:
+                self.coords = (data['z0'], data['y0'], data['x0'])
+            for name in data.files:
+                if name.startswith('bins|'):
+                    _, bins_key, i = name.split('|')
+                    bins = self.bins.setdefault(bins_key, [None]*3)
+                    bins[int(i)] = data[name]
+        self.bins = {bins_key: tuple(bins)
+                     for bins_key, bins in self.bins.items()}
+        return True
+
+    def save(self):
+        """
+        Write the geometry to the sidecar file (if any and if it changed).
+        The file is replaced atomically.
+
+        Returns:
+            None.
+
+        """
+        if (self.sidecar is None) or (self.modified is False):
+            return
+        data = {'key': np.array(self.key)}
+        if self.coords is not None:
+            data['z0'], data['y0'], data['x0'] = self.coords
+        for bins_key, bins in self.bins.items():
+            for i, edges in enumerate(bins):
+                data['bins|' + bins_key + '|' + str(i)] = edges
+        tmp_file = self.sidecar + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(tmp_file, **data)
+        os.replace(tmp_file, self.sidecar)
+        self.modified = False
+        print('-> GEOM  >> Grid geometry saved in', self.sidecar)
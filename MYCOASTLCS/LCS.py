@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """ LCS Module: This module contains the function to extract the Lagrangian
-Coherent structures as ridges in the 2D FTLE field.
+Coherent structures as ridges in the 2D FTLE field, or ridge surfaces in the
+3D FTLE field.
 
 The detection of LCS based on the FTLE ridge extraction introduced in [a]_
 
@@ -22,24 +23,102 @@ within the surface and repulsion normal to it,
 :math:`μ_1 > 0 > μ_2`
 """
 
+from typing import TYPE_CHECKING
 import xarray as xr
 import numpy as np
-from skimage.feature import hessian_matrix, hessian_matrix_eigvals
+from skimage.feature import hessian_matrix
 from skimage.measure import label
+from .MemoryBudget import get_slab_size
+
+if TYPE_CHECKING:
+    import pandas as pd  # only needed by the ridge statistics (stats extra)
+
+
+def eig_sym_2d(a, b, c):
+    """ Gets the eigenvalues and the eigenvectors of a field of 2x2 symmetric
+    matrices [[a, b], [b, c]] using the closed-form solution.
+
+    The major eigenvector is (cos(theta), sin(theta)) and the minor one
+    (-sin(theta), cos(theta)), with theta in [-pi/2, pi/2], so the sign of
+    the eigenvectors is deterministic.
+
+    Args:
+        - a, b, c (np.array): independent components of the symmetric
+        matrices.
+
+    Returns:
+        - eigval_min, eigval_max (np.array): eigenvalues.
+        - evec_min, evec_max (tuple): (x, y) components of the eigenvectors.
+
+    """
+    mean = 0.5*(a + c)
+    radius = np.hypot(0.5*(a - c), b)
+    theta = 0.5*np.arctan2(2*b, a - c)
+    cos, sin = np.cos(theta), np.sin(theta)
+    return mean - radius, mean + radius, (-sin, cos), (cos, sin)
+
+
+def import_pandas():
+    """ pandas, needed by the ridge statistics (get_ridge_stats). """
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError('The ridge statistics (LCS ridge_stats) need '
+                          'pandas: pip install MYCOASTLCS[stats]')
+    return pd
 
 
 class LCS:
 
     def __init__(self, eval_thrsh='infer', ftle_thrsh='infer', area_thrsh=100,
-                 nr_neighb=8, ridge_points_flag=False, to_dataset=True):
+                 nr_neighb=8, ridge_points_flag=False, to_dataset=True,
+                 ridge_stats=False, memory_budget_mb=1024.):
 
         self.eval_thrsh = eval_thrsh
         self.ftle_thrsh = ftle_thrsh
         self.area_thrsh = area_thrsh
         self.nr_neighb = nr_neighb
         self.ridge_points_flag = ridge_points_flag
+        self.ridge_stats = ridge_stats
+        self.memory_budget_mb = memory_budget_mb
+        self.sigma = 3
+
+    def get_halo(self) -> int:
+        """
+        Number of grid points around a point that the Hessian of the FTLE
+        at that point depends on (Gaussian filter radius plus the two
+        finite difference stencils).
+
+        Returns:
+            halo (int): halo width in grid points.
+
+        """
+        return int(4*self.sigma + 0.5) + 2
 
-    def get_lcs_mask_2d(self, ds):
+    def get_connectivity(self, ndim: int) -> int:
+        """
+        Connectivity of label() for 2D or 3D masks: nr_neighb, up to the
+        number of dimensions (full connectivity).
+        """
+        return min(int(self.nr_neighb), ndim)
+
+    @staticmethod
+    def get_directions(ds: xr.Dataset, prefix: str = 'FTLE_') -> list:
+        """ Directions (forward, backward) with a prefix field in ds. """
+        return [direction for direction in ['forward', 'backward']
+                if prefix + direction in ds.keys()]
+
+    @staticmethod
+    def get_horizon_dim(da: xr.DataArray) -> str:
+        """
+        Integration time dimension of a field (integration_time, or
+        integration_time_backward in paired forward/backward datasets).
+        None for a single integration time.
+        """
+        dims = [dim for dim in da.dims if dim.startswith('integration_time')]
+        return dims[0] if len(dims) > 0 else None
+
+    def get_lcs_mask_2d(self, ds, direction=None):
         """
 
          Extract points that sit on the dominant ridges of FTLE 2D data
@@ -62,12 +141,20 @@ class LCS:
             to obtain the threshold from the 95 percentile of the data of the
             FTLE field.
             - area_thrsh (float, optional):  scalar. Selects connected areas
-            (with 4 or 8 neighbors) larger than area_thrsh
-            - nr_neighb (int, optional): scalar. Connection neighbours (4 or 8)
+            (with 4 or 8 neighbors) larger than area_thrsh. For 3D fields,
+            connected volumes (grid points).
+            - nr_neighb (int, optional): scalar. Connectivity of the
+            connected areas: 1 (4 neighbours) or 2 (8 neighbours), up to 3
+            (26 neighbours) for 3D fields. Larger values use the full
+            connectivity.
             - ridge_points_flag (bool, optional): x0,y0 exact ridge poisition if 1.
             (matrix coordinates)
+            - memory_budget_mb (float, optional): working memory in MB of
+            the 3D Hessian, computed by z-slabs.
             - to_dataset (bool, optional): Logical mask for ridges in the FTLE
             field LCS_forward and LCS_backward to the outputted dataset.
+            - direction (str, optional): 'forward' or 'backward' FTLE field.
+            By default, the forward one if it is in ds.
 
 
         Example:
@@ -83,36 +170,73 @@ class LCS:
             y0: Positions of points on FTLE ridges
         """
 
-        if 'FTLE_forward' in ds.keys():
-            ftle = ds['FTLE_forward'].fillna(0).squeeze().values
-            m, n = ftle.shape
-        elif 'FTLE_backward' in ds.keys():
-            ftle = ds['FTLE_backward'].fillna(0).squeeze().values
-            m, n = ftle.shape
+        if direction is None:
+            direction = self.get_directions(ds)[0]
+        ftle = ds['FTLE_' + direction].fillna(0)
+
+        # Several integration times: one LCS mask per horizon.
+        horizon_dim = self.get_horizon_dim(ftle)
+        if horizon_dim is not None:
+            ridge_mask, ridge = [], []
+            for i in range(0, ftle[horizon_dim].size):
+                print('-> LCS   >> Integration time:',
+                      ftle[horizon_dim].values[i], 's')
+                ridge_mask_i, ridge_i = self.get_lcs_mask_from_ftle(
+                    ftle.isel({horizon_dim: i}).squeeze().values)
+                ridge_mask.append(ridge_mask_i)
+                ridge.append(ridge_i)
+            return np.stack(ridge_mask), np.stack(ridge)
+
+        return self.get_lcs_mask_from_ftle(ftle.squeeze().values)
+
+    def get_lcs_mask_from_ftle(self, ftle: np.array):
+        """
+        Extract the ridge mask from a 2D FTLE array. See get_lcs_mask_2d.
+
+        The 'infer' thresholds are estimated for each FTLE field.
+
+        Args:
+            ftle (np.array): 2D FTLE field without NaN.
 
-        if self.ftle_thrsh == 'infer':
-            self.ftle_thrsh = np.percentile(ftle, 95)
+        Returns:
+            ridge_mask: logical mask for ridges in FTLE field
+            ridge: inner product of the FTLE gradient and the minor
+            eigenvector of the Hessian.
+
+        """
+        EVal, ridge = self.get_hessian_ridges(ftle)
+        ridge_mask = self.get_ridge_mask(ftle, EVal)
+        return ridge_mask, ridge
+
+    def get_hessian_ridges(self, ftle: np.array):
+        """
+        Get the minimum eigenvalue of the FTLE Hessian and the ridge field.
+        Both only depend on the FTLE values within get_halo() points, so
+        they can be computed by tiles. 3D fields are passed to
+        get_hessian_ridges_3d.
+
+        Args:
+            ftle (np.array): 2D (or 3D) FTLE field without NaN.
+
+        Returns:
+            EVal: minimum eigenvalue of the Hessian.
+            ridge: inner product of the FTLE gradient and the minor
+            eigenvector of the Hessian.
+
+        """
+        if ftle.ndim == 3:
+            return self.get_hessian_ridges_3d(ftle)
 
         # Gradient and Hessian matrix (2nd derivatives) from finite differences
         [dy, dx] = np.gradient(ftle)
 
         # Make 2D hessian
-        hxx, hxy, hyy = hessian_matrix(ftle, sigma=3, order='xy')
+        hxx, hxy, hyy = hessian_matrix(ftle, sigma=self.sigma, order='xy')
 
-        i1, i2 = hessian_matrix_eigvals([hxx, hxy, hyy])
-
-        Lambda2 = np.zeros_like(hxx)
-        Lambda1 = np.zeros_like(hxx)
-        EVecx = np.zeros_like(hxx)
-        EVecy = np.zeros_like(hxx)
-
-        for i in range(0, m):
-            for j in range(0, n):
-                eigvalue, eigenvec = np.linalg.eigh(
-                    np.matrix([[hxx[i, j], hxy[i, j]],
-                               [hxy[i, j], hyy[i, j]]]))
-                Lambda2[i, j], Lambda1[i, j], = eigvalue
-                EVecx[i, j], EVecy[i, j] = eigenvec[1, 0], eigenvec[1, 1]
+        # Eigenvalues and eigenvectors of the Hessian for the whole field.
+        # EVecx, EVecy: y components of the minor and major eigenvectors.
+        Lambda2, Lambda1, evec_min, evec_max = eig_sym_2d(hxx, hxy, hyy)
+        EVecx, EVecy = evec_min[1], evec_max[1]
 
         EVal = np.minimum(Lambda2, Lambda1)
         # EVal = np.nan_to_num(EVal)
@@ -121,15 +245,87 @@ class LCS:
         # Define ridges as zero level lines of inner product
         # of gradient and eigenvector of smaller (negative) eigenvalue
         ridge = EVecx*dx + EVecy*dy
+        return EVal, ridge
+
+    def get_hessian_ridges_3d(self, ftle: np.array):
+        """
+        Get the minimum eigenvalue of the 3x3 FTLE Hessian and the ridge
+        field (inner product of the FTLE gradient and the eigenvector of the
+        minimum eigenvalue, normal to the ridge surface).
+
+        The domain is processed in z-slabs sized with memory_budget_mb, read
+        with a halo of get_halo() layers, and the eigen-decomposition of each
+        slab is batched.
+
+        Args:
+            ftle (np.array): 3D FTLE field [z, y, x] without NaN.
+
+        Returns:
+            EVal: minimum eigenvalue of the Hessian.
+            ridge: inner product of the FTLE gradient and the minor
+            eigenvector of the Hessian.
+
+        """
+        nz, ny, nx = ftle.shape
+        halo = self.get_halo()
+        # Hessian, matrices, eigenvectors and gradients: ~40 doubles/point.
+        slab = get_slab_size(self.memory_budget_mb, ny*nx, 40*8)
+
+        EVal = np.zeros_like(ftle)
+        ridge = np.zeros_like(ftle)
+        for k0 in range(0, nz, slab):
+            k1 = min(k0 + slab, nz)
+            lo, hi = max(k0 - halo, 0), min(k1 + halo, nz)
+            inner = slice(k0 - lo, k1 - lo)
+            block = ftle[lo:hi]
+
+            # Gradient and Hessian matrix (2nd derivatives) of the slab
+            grad = np.stack(np.gradient(block), axis=-1)[inner]
+            H = hessian_matrix(block, sigma=self.sigma, order='rc')
+            H = [h[inner] for h in H]
+            hzz, hzy, hzx, hyy, hyx, hxx = H
+            matrices = np.stack([np.stack([hzz, hzy, hzx], axis=-1),
+                                 np.stack([hzy, hyy, hyx], axis=-1),
+                                 np.stack([hzx, hyx, hxx], axis=-1)], axis=-2)
+            eigval, eigvec = np.linalg.eigh(matrices)
+            evec_min = eigvec[..., 0]
+            # Deterministic sign: largest component of the eigenvector > 0
+            largest = np.take_along_axis(
+                evec_min, np.abs(evec_min).argmax(axis=-1)[..., np.newaxis],
+                axis=-1)
+            evec_min = evec_min*np.where(largest < 0, -1., 1.)
+
+            EVal[k0:k1] = eigval[..., 0]
+            ridge[k0:k1] = np.sum(evec_min*grad, axis=-1)
+        return EVal, ridge
+
+    def get_ridge_mask(self, ftle: np.array, EVal: np.array) -> np.array:
+        """
+        Get the ridge mask from the FTLE and the minimum eigenvalue of its
+        Hessian: thresholds and removal of small connected areas (volumes
+        for 3D fields, with area_thrsh in grid points).
+
+        Args:
+            ftle (np.array): 2D or 3D FTLE field without NaN.
+            EVal (np.array): minimum eigenvalue of the Hessian.
+
+        Returns:
+            ridge_mask: logical mask for ridges in FTLE field
 
-        if self.eval_thrsh == 'infer':
-            self.eval_thrsh = np.percentile(EVal, 95)
+        """
+        ftle_thrsh = self.ftle_thrsh
+        if ftle_thrsh == 'infer':
+            ftle_thrsh = np.percentile(ftle, 95)
+
+        eval_thrsh = self.eval_thrsh
+        if eval_thrsh == 'infer':
+            eval_thrsh = np.percentile(EVal, 95)
 
         # Define filter masks with high negative curvature
-        Eval_neg_bin = EVal < self.eval_thrsh
+        Eval_neg_bin = EVal < eval_thrsh
 
         # High FTLE value
-        FTLE_high_bin = ftle > self.ftle_thrsh
+        FTLE_high_bin = ftle > ftle_thrsh
 
         # Combined mask
         ridge_mask = FTLE_high_bin*Eval_neg_bin
@@ -137,104 +333,215 @@ class LCS:
         # Remove small connected areas in combined mask
 
         # label areas
-        L = label(ridge_mask, connectivity=self.nr_neighb)
-        # filter mask
+        L = label(ridge_mask, connectivity=self.get_connectivity(ftle.ndim))
         Lmax = L.max()
-        for i in range(1, Lmax):
-            if ((L[L == i]).size < self.area_thrsh):  # || (Lmax_ind > L_f/2)
-                L[L == i] = 0
+
+        # filter mask: areas of all the labels at once
+        area = np.bincount(L.ravel(), minlength=Lmax + 1)
+        keep = area >= self.area_thrsh
+        keep[0] = False
 
         # set new mask
-        ridge_mask[L > 0] = 1
-        ridge_mask[L == 0] = 0
+        ridge_mask = keep[L]
 
         print('-> LCS   >> Area threshold:', self.area_thrsh)
-        print('-> LCS   >> FTLE threshold:', self.ftle_thrsh)
-        print('-> LCS   >> EVal threshold:', self.eval_thrsh)
+        print('-> LCS   >> FTLE threshold:', ftle_thrsh)
+        print('-> LCS   >> EVal threshold:', eval_thrsh)
         print('-> LCS   >> Potential LCS:', Lmax)
 
-        return ridge_mask, ridge
+        return ridge_mask
+
+    def get_ridge_stats(self, ds: xr.Dataset) -> 'pd.DataFrame':
+        """
+        Statistics of each ridge (connected area) of the LCS mask: area
+        (grid points), mean and max FTLE, bounding box and centroid in grid
+        coordinates (x0, y0, and z0 for 3D fields). The ridges are labelled
+        with the nr_neighb connectivity. It needs pandas (stats extra).
+
+        Args:
+            ds (xr.Dataset): Dataset containing FTLE and LCS fields.
 
-    def to_dataset(self, ds: xr.Dataset, ridge_mask: np.array):
+        Returns:
+            stats (pd.DataFrame): One row per ridge and integration time.
+
+        """
+        pd = import_pandas()
+        stats = [self.get_ridge_stats_direction(ds, direction)
+                 for direction in self.get_directions(ds, 'LCS_')]
+        stats = pd.concat(stats, ignore_index=True)
+        stats.insert(0, 'time', ds.time.values[0])
+        print('-> LCS   >> Ridges in the statistics table:', len(stats))
+        return stats
+
+    def get_ridge_stats_direction(self, ds: xr.Dataset,
+                                  direction: str) -> 'pd.DataFrame':
+        """ Ridge statistics of one direction. See get_ridge_stats. """
+        pd = import_pandas()
+        ftle = ds['FTLE_' + direction].fillna(0)
+        lcs = ds['LCS_' + direction].fillna(0)
+        horizon_dim = self.get_horizon_dim(ftle)
+        if horizon_dim is not None:
+            horizons = ftle[horizon_dim].values
+            ftle = ftle.transpose(horizon_dim, ...).values
+            lcs = lcs.transpose(horizon_dim, ...).values
+        else:
+            horizons = [None]
+            ftle = ftle.squeeze().values[np.newaxis]
+            lcs = lcs.squeeze().values[np.newaxis]
+
+        names = ['z', 'y', 'x'] if 'z0' in ds[
+            'FTLE_' + direction].dims else ['y', 'x']
+        coords = np.meshgrid(*[ds[name + '0'].values for name in names],
+                             indexing='ij')
+        coords = [(name, coord.ravel()) for name, coord in zip(names, coords)]
+        coords = coords[::-1]
+        connectivity = self.get_connectivity(len(names))
+        stats = []
+        for i, horizon in enumerate(horizons):
+            L = label(lcs[i] > 0, connectivity=connectivity).ravel()
+            n = L.max() + 1
+            area = np.bincount(L, minlength=n)
+            ftle_i = ftle[i].ravel()
+            ftle_max = np.full(n, -np.inf)
+            np.maximum.at(ftle_max, L, ftle_i)
+            bbox = {}
+            for name, coord in coords:
+                bbox[name + '_min'] = np.full(n, np.inf)
+                bbox[name + '_max'] = np.full(n, -np.inf)
+                np.minimum.at(bbox[name + '_min'], L, coord)
+                np.maximum.at(bbox[name + '_max'], L, coord)
+            columns = {
+                'label': np.arange(1, n),
+                'area': area[1:],
+                'ftle_mean': np.bincount(L, ftle_i, n)[1:]/area[1:],
+                'ftle_max': ftle_max[1:]}
+            for name, coord in coords:
+                columns[name + '_min'] = bbox[name + '_min'][1:]
+                columns[name + '_max'] = bbox[name + '_max'][1:]
+            for name, coord in coords:
+                columns[name + '_centroid'] = \
+                    np.bincount(L, coord, n)[1:]/area[1:]
+            table = pd.DataFrame(columns)
+            table.insert(0, 'direction', direction)
+            if horizon is not None:
+                table.insert(1, 'integration_time', horizon)
+            stats.append(table)
+        return pd.concat(stats, ignore_index=True)
+
+    def to_dataset(self, ds: xr.Dataset, ridge_mask: np.array,
+                   direction=None):
         """
         Add to the dataset the mask with potential LCS detected from FTLE.
 
         Args:
             ds (xr.Dataset): Dataset containing FTLE fields.
             ridge_mask (np.array): boolean array. True = LCS candidate
+            direction (str, optional): 'forward' or 'backward'. By default,
+            the forward one if it is in ds.
 
         Returns:
             None.
 
         """
-        if 'FTLE_forward' in ds.keys():
-            ds['LCS_forward'] = (ds['FTLE_forward'].dims, ridge_mask)
-            ds['LCS_forward'] = ds.LCS_forward.where(~np.isnan(ds.FTLE_forward))
-        elif 'FTLE_backward' in ds.keys():
-            ds['LCS_backward'] = (ds['FTLE_backward'].dims, ridge_mask)
-            ds['LCS_backward'] = ds.LCS_backward.where(~np.isnan(ds.FTLE_backward))
+        if direction is None:
+            direction = self.get_directions(ds)[0]
+        ftle = ds['FTLE_' + direction]
+        ds['LCS_' + direction] = (ftle.dims, ridge_mask)
+        ds['LCS_' + direction] = ds['LCS_' + direction].where(~np.isnan(ftle))
+
+    def get_lcs_ridge_points(self, ridge_mask: np.array, ridge: np.array,
+                             x0: np.array,
+                             y0: np.array) -> [np.array, np.array]:
+        """
+        Extract the geometric x,y ridge positions (sub-pixel) from the LCS
+        mask: zero crossings of the ridge field (inner product of the FTLE
+        gradient and the minor eigenvector) between neighbour points along
+        x and along y. The crossing is kept if the nearest point belongs to
+        the LCS mask. Its position is linearly interpolated in the grid
+        coordinates.
 
-    def get_lcs_ridge_points(self, ridge_mask: np.array) -> [list, list]:
+        Args:
+            ridge_mask (np.array): boolean array. True = LCS candidate
+            ridge (np.array): ridge field.
+            x0 (np.array): x grid coordinates.
+            y0 (np.array): y grid coordinates.
+
+        Returns:
+            x_ridge (np.array): x ridge points
+            y_ridge (np.array): y ridge points
+
+        """
+        ridge_mask = ridge_mask.astype(bool)
+        x_ridge, y_ridge = [], []
+        for axis in [1, 0]:
+            r0 = np.moveaxis(ridge, axis, -1)[..., :-1]
+            r1 = np.moveaxis(ridge, axis, -1)[..., 1:]
+            mask = np.moveaxis(ridge_mask, axis, -1)
+            cross = (r0*r1 < 0) | ((r0 == 0) & (r1 != 0))
+            i, j = np.nonzero(cross)
+            t = r0[i, j]/(r0[i, j] - r1[i, j])
+            # round zero point to the nearest grid point
+            nearest = mask[i, j + (t >= 0.5)]
+            i, j, t = i[nearest], j[nearest], t[nearest]
+            coord = x0 if axis == 1 else y0
+            along = coord[j] + t*(coord[j + 1] - coord[j])
+            if axis == 1:
+                x_ridge.append(along)
+                y_ridge.append(y0[i])
+            else:
+                x_ridge.append(x0[i])
+                y_ridge.append(along)
+        return np.concatenate(x_ridge), np.concatenate(y_ridge)
+
+    def ridge_points_to_dataset(self, ds: xr.Dataset, ridge_mask: np.array,
+                                ridge: np.array, direction=None):
         """
-        Extract the geometric x,y ridge postions from the LCS mask.
+        Add the ridge points to the dataset as a contiguous ragged array:
+        LCS_<direction>_x and LCS_<direction>_y along the
+        LCS_<direction>_point dimension. With several integration times,
+        LCS_<direction>_point_count has the number of points of each one.
+        Only 2D fields: 3D ridges are surfaces, given by the LCS mask.
 
         Args:
+            ds (xr.Dataset): Dataset containing FTLE fields.
             ridge_mask (np.array): boolean array. True = LCS candidate
+            ridge (np.array): ridge field.
+            direction (str, optional): 'forward' or 'backward'. By default,
+            the forward one if it is in ds.
 
         Returns:
-            x_ridge (list): list of x ridge points
-            y_ridge (list): list of y ridge points
-
-        """
-
-        m, n = ridge_mask.shape
-        X = np.arange(1, n)
-        Y = np.arange(1, m)
-        cnt = 0
-        x_ridge = []
-        y_ridge = []
-        for i in np.arange(0, m-1):
-            for j in np.arange(0, n-2):
-                if ridge_mask[i, j] == 1:
-                    x = X[j:j+2]
-                    z = np.array([ridge_mask[i, j], ridge_mask[i, j+1]])
-                    m1 = (z[1]-z[0])/(x[1]-x[0])  # Calculamos la pendiente
-                    # Calculamos el punto de corte con el eje y,
-                    n1 = z[0] - m1*x[0]
-                    # round zero point (-n1/m1) to the nearest j
-                    if(np.abs(-n1/m1-x[0]) < np.abs(-n1/m1-x[1])):
-                        js = j
-                    else:
-                        js = j+1
-                    if(x[0] < -n1/m1 and -n1/m1 < x[1] and
-                       ridge_mask[i, js] == 1):
-                        cnt = cnt+1
-                        x_ridge.append(-n1/m1)
-                        y_ridge.append(Y[i])
-
-        for i in np.arange(0, m-2):
-            for j in np.arange(0, n-1):
-                if ridge_mask[i, j] == 1:
-                    y = Y[i:i+2]
-                    z = np.array([ridge_mask[i, j], ridge_mask[i+1, j]])
-                    m1 = (z[1]-z[0])/(y[1]-y[0])
-                    n1 = z[0] - m1*y[0]
-                    # round zero point (-n1/m1) to the nearest i
-                    if(np.abs(-n1/m1-y[0]) < np.abs(-n1/m1-y[1])):
-                        isi = i
-                    else:
-                        isi = i+1
-
-                    if(y[0] < -n1/m1 and
-                       -n1/m1 < y[1] and  ridge_mask[isi, j] == 1):
-                        cnt = cnt+1
-                        x_ridge.append(X[j])
-                        y_ridge.append(-n1/m1)
-
-                return x_ridge, y_ridge, ridge_mask
+            None.
+
+        """
+        if direction is None:
+            direction = self.get_directions(ds)[0]
+        name = 'LCS_' + direction
+        if 'z0' in ds['FTLE_' + direction].dims:
+            print('-> LCS   >> Ridge points only available for 2D fields')
+            return
+        x0, y0 = ds.x0.values, ds.y0.values
+        if ridge_mask.ndim == 2:
+            x_ridge, y_ridge = self.get_lcs_ridge_points(ridge_mask, ridge,
+                                                         x0, y0)
+        else:
+            points = [self.get_lcs_ridge_points(ridge_mask[i], ridge[i],
+                                                x0, y0)
+                      for i in range(0, ridge_mask.shape[0])]
+            x_ridge = np.concatenate([point[0] for point in points])
+            y_ridge = np.concatenate([point[1] for point in points])
+            horizon_dim = self.get_horizon_dim(ds['FTLE_' + direction])
+            ds[name + '_point_count'] = (
+                (horizon_dim,), [point[0].size for point in points],
+                {'sample_dimension': name + '_point'})
+        ds[name + '_x'] = ((name + '_point',), x_ridge,
+                           {'long_name': 'x of the ridge points'})
+        ds[name + '_y'] = ((name + '_point',), y_ridge,
+                           {'long_name': 'y of the ridge points'})
+        print('-> LCS   >> Ridge points:', x_ridge.size)
 
     def get_lcs(self, ds:xr.Dataset):
-        """Get the LCS from a xr.Dataset containing FTLE field"
+        """Get the LCS from a xr.Dataset containing FTLE field". A dataset
+        with the forward and backward FTLE fields gets both LCS masks.
 
         Args:
             ds (xr.Dataset): DESCRIPTION.
@@ -244,7 +551,9 @@ class LCS:
 
         """
 
-        ridge_mask, ridge = self.get_lcs_mask_2d(ds)
-        self.to_dataset(ds, ridge_mask)
-        if self.ridge_points_flag is True:
-            self.get_lcs_ridge_points(ridge_mask, ridge)
+        for direction in self.get_directions(ds):
+            print('-> LCS   >> Direction:', direction)
+            ridge_mask, ridge = self.get_lcs_mask_2d(ds, direction)
+            self.to_dataset(ds, ridge_mask, direction)
+            if self.ridge_points_flag:
+                self.ridge_points_to_dataset(ds, ridge_mask, ridge, direction)
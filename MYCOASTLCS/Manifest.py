@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+""" Manifest module. It records the input files already processed by a run,
+so an interrupted batch can be resumed and a re-run with the same setup
+skips the finished files.
+
+Each entry of the manifest (JSON) is written atomically after a file is
+processed and records:
+
+    - input file path, size and modification time.
+    - hash of the setup (JSON config).
+    - initial time of the file (merge order).
+    - output files of the file and the FTLE/LCS piece used to build the
+      merged output.
+    - backward file paired with it (paired forward/backward mode).
+
+A file is skipped when its entry matches the input file and the setup and
+its outputs still exist.
+"""
+
+import hashlib
+import json
+import os
+
+
+def get_config_hash(setup: dict) -> str:
+    """
+    Hash of a setup. The keys that do not change the results (number of
+    workers, manifest file) are not included.
+
+    Args:
+        setup (dict): setup of the json file.
+
+    Returns:
+        config_hash (str): hexadecimal hash.
+
+    """
+    setup = dict(setup)
+    setup['common'] = {key: value for key, value in setup['common'].items()
+                       if key not in ['n_workers', 'manifest']}
+    return hashlib.sha1(json.dumps(setup, sort_keys=True).encode()).hexdigest()
+
+
+def get_file_stamp(input_file: str) -> dict:
+    """ Size and modification time of a file. """
+    stat = os.stat(input_file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def get_paired_stamp(paired_file: str) -> dict:
+    """ Path, size and modification time of a paired file (or None). """
+    if paired_file is None:
+        return None
+    return {'file': os.path.abspath(paired_file),
+            'stamp': get_file_stamp(paired_file)}
+
+
+class Manifest:
+
+    def __init__(self, filename: str, setup: dict):
+        """
+        Manifest initializer. An existing manifest file is read.
+
+        Args:
+            filename (str): JSON manifest file.
+            setup (dict): setup of the json file.
+
+        Returns:
+            None.
+
+        """
+        self.filename = filename
+        self.config_hash = get_config_hash(setup)
+        self.entries = {}
+        self.merged = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as manifest_file:
+                manifest = json.load(manifest_file)
+            self.entries = manifest.get('files', {})
+            self.merged = manifest.get('merged', {})
+        self.piece_dir = os.path.splitext(self.filename)[0] + '_pieces'
+
+    def get_entry(self, input_file: str, paired_file: str = None) -> dict:
+        """
+        Entry of an input file if it is still valid: same input file
+        (size, mtime), same paired file, same setup and existing outputs.
+
+        Args:
+            input_file (str): input netCDF file.
+            paired_file (str, optional): backward file paired with it.
+
+        Returns:
+            entry (dict): manifest entry or None.
+
+        """
+        entry = self.entries.get(os.path.abspath(input_file))
+        if entry is None:
+            return None
+        if (entry['stamp'] != get_file_stamp(input_file)) or \
+                (entry['config_hash'] != self.config_hash) or \
+                (entry.get('paired') != get_paired_stamp(paired_file)):
+            return None
+        files = list(entry['outputs'].values())
+        if entry['piece'] is not None:
+            files.append(entry['piece'])
+        if not all([os.path.exists(file) for file in files]):
+            return None
+        return entry
+
+    def get_piece_filename(self, input_file: str) -> str:
+        """ FTLE/LCS piece file of an input file. """
+        input_file = os.path.abspath(input_file)
+        base_filename = os.path.basename(input_file).split('.')[0]
+        key = hashlib.sha1(input_file.encode()).hexdigest()[:8]
+        os.makedirs(self.piece_dir, exist_ok=True)
+        return os.path.join(self.piece_dir,
+                            base_filename + '_' + key + '_ftle_lcs.nc')
+
+    def add(self, input_file: str, t0, outputs: dict, piece: str = None,
+            paired_file: str = None):
+        """
+        Record a processed input file and save the manifest.
+
+        Args:
+            input_file (str): input netCDF file.
+            t0 (np.datetime64): initial time of the file.
+            outputs (dict): output files by stage.
+            piece (str, optional): FTLE/LCS piece of the merged output.
+            paired_file (str, optional): backward file paired with it.
+
+        Returns:
+            None.
+
+        """
+        self.entries[os.path.abspath(input_file)] = {
+            'stamp': get_file_stamp(input_file),
+            'config_hash': self.config_hash,
+            't0': str(t0),
+            'outputs': {stage: os.path.abspath(file)
+                        for stage, file in outputs.items()},
+            'piece': None if piece is None else os.path.abspath(piece),
+            'paired': get_paired_stamp(paired_file)}
+        self.save()
+
+    def is_merged(self, output_file: str, pieces: list) -> bool:
+        """ True if output_file was already merged from the same pieces. """
+        return (self.merged.get('output') == os.path.abspath(output_file)) and \
+            (self.merged.get('pieces') == pieces) and \
+            (self.merged.get('config_hash') == self.config_hash) and \
+            os.path.exists(output_file)
+
+    def set_merged(self, output_file: str, pieces: list):
+        """ Record the merged output and its pieces and save the manifest. """
+        self.merged = {'output': os.path.abspath(output_file),
+                       'pieces': pieces,
+                       'config_hash': self.config_hash}
+        self.save()
+
+    def save(self):
+        """ Write the manifest atomically. """
+        manifest = {'files': self.entries, 'merged': self.merged}
+        tmp_file = self.filename + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_file, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        os.replace(tmp_file, self.filename)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+""" MemoryBudget module. The large fields (FTLE, LCS Hessian) are processed
+in slabs of grid points (z-layers, time blocks) sized with the working
+memory budget (memory_budget_mb) of each stage.
+"""
+
+
+def get_slab_size(memory_budget_mb: float, points_per_slab: int,
+                  bytes_per_point: int) -> int:
+    """
+    Number of slabs that can be processed at once without exceeding the
+    memory budget.
+
+    Args:
+        memory_budget_mb (float): working memory (MB).
+        points_per_slab (int): number of grid points in one slab.
+        bytes_per_point (int): working memory needed per grid point.
+
+    Returns:
+        slab_size (int): number of slabs per block (at least 1).
+
+    """
+    budget = memory_budget_mb*1024.*1024.
+    return int(max(1, budget // (points_per_slab*bytes_per_point)))
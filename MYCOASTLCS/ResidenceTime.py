@@ -5,6 +5,9 @@ import numpy as np
 import xarray as xr
 from .GridBased import GridBased
 
+# New (particle, cell) keys of the streamed chunks kept before a merge
+VISITS_MERGE_SIZE = 2**20
+
 
 class ResidenceTime(GridBased):
 
@@ -33,13 +36,17 @@ class ResidenceTime(GridBased):
         self.name = 'residence_time'
         self.abbrev = 'RESD'
 
-    def get_counts(self, ds: xr.Dataset) -> np.array:
+    def get_counts(self, ds: xr.Dataset, cell_index=None) -> np.array:
         """Computes the average residence time. For each particle, it
         aproximates the time that a particles spents on a cell.
 
+        Lazy (dask) datasets are reduced chunk by chunk along the first
+        grid dimension.
+
         Args:
 
             ds (xr.Dataset): Description
+            cell_index (CellIndex, optional): shared cell index cache.
 
         Returns:
             residence_time(np.array): array with average time spent at cell.
@@ -47,73 +54,175 @@ class ResidenceTime(GridBased):
         """
         print('-> RESD  >> Computing... ')
 
-        n_tzyx = list(map(np.size, self.centers))
-        time_in_cell = np.zeros((n_tzyx))
-        mask_dif_id = np.zeros((n_tzyx))
-
         # Assuming that all particles have same dt
         dt = np.array((ds.time[1]-ds.time[0]).values, dtype='timedelta64[s]')
         dt = dt/np.timedelta64(1, 's')
-        nz, ny, nx = ds.z0.size, ds.y0.size, ds.x0.size
-        n_p = nz*nx*ny
-
-        counter = 0
-
-        # We move the check of the dimension to the outest part of the loop
-        # to avoid excesive number of check
-        if time_in_cell.ndim == 3:
-            for i in range(0, nz):
-                for j in range(0, ny):
-                    for k in range(0, nx):
-                        if nz > 1:
-                            r = np.c_[ds.z[:, i, j, k].values,
-                                      ds.y[:, i, j, k].values,
-                                      ds.x[:, i, j, k].values]
-                        else:
-                            r = np.c_[ds.z[:, j, k].values,
-                                      ds.y[:, j, k].values,
-                                      ds.x[:, j, k].values]
-                        # If particle is NaN go to next
-                        if np.all(r == np.nan):
-                            continue
-                        counts, _ = np.histogramdd(r, bins=self.bins)
-                        time_in_cell += counts*dt  # Counts the time
-                        mask_dif_id += (counts > 0)
-                        counter += 1
-                    print('-> RESD  >> ', '%3.2f' % (counter/n_p*100.),
-                          '%', end="\r", flush=True)
-
-        elif time_in_cell.ndim == 2:
-            for i in range(0, nz):
-                for j in range(0, ny):
-                    for k in range(0, nx):
-                        r = np.c_[ds.y[:, j, k].values,
-                                  ds.x[:, j, k].values]
-                        if np.all(r == np.nan):  # If nan particle, go to next
-                            continue
-                        counts, _ = np.histogramdd(r, bins=self.bins)
-                        time_in_cell += counts*dt
-                        mask_dif_id += (counts > 0)
-                        counter += 1
-                    print('-> RESD  >> ', '%3.2f' % (counter/n_p*100.),
-                          '%', end="\r", flush=True)
+
+        if cell_index is not None:
+            counts = [self.count_index(cell_index.get_index(self, ds))]
+        else:
+            counts = self.apply_by_blocks(self.count_block, ds, ds.x.dims[1])
+        time_in_cell = sum([count[0] for count in counts])*dt
+        mask_dif_id = sum([count[1] for count in counts])
 
         residence_time = time_in_cell/mask_dif_id  # average residence time
         return residence_time
 
-    def get_residence_time(self, ds_input: xr.Dataset) -> xr.Dataset:
+    def count_block(self, z: np.array, y: np.array, x: np.array) -> tuple:
+        """Counts, for a block of particles, the number of timesteps spent
+        on each cell and the number of different particles visiting it.
+
+        Args:
+            z, y, x (np.array): Particle positions with time as first axis.
+
+        Returns:
+            time_in_cell(np.array): timesteps spent at each cell.
+            mask_dif_id(np.array): number of particles visiting each cell.
+
+        """
+        nt = z.shape[0]
+        index = self.get_cell_index(z.reshape(nt, -1), y.reshape(nt, -1),
+                                    x.reshape(nt, -1))
+        return self.count_index(index)
+
+    def count_index(self, index: np.array) -> tuple:
+        """Counts, from the cell index of the positions, the number of
+        timesteps spent on each cell and the number of different particles
+        visiting it.
+
+        Args:
+            index (np.array): flat cell index [time, particle]. NaN (land)
+            and outside positions are -1 and they are dropped.
+
+        Returns:
+            time_in_cell(np.array): timesteps spent at each cell.
+            mask_dif_id(np.array): number of particles visiting each cell.
+
+        """
+        n_tzyx = list(map(np.size, self.centers))
+        n_cells = int(np.prod(n_tzyx))
+
+        time_in_cell = np.zeros(n_cells + 1, dtype=np.int64)
+        mask_dif_id = np.zeros(n_cells + 1, dtype=np.int64)
+        block = max(1, 2**24//max(index.shape[0], 1))
+        for p0 in range(0, index.shape[1], block):
+            # [particle, time] copy of a block of particles
+            index_block = np.array(index[:, p0:p0 + block].T)
+            index_block += 1
+
+            # Timesteps spent on each cell
+            time_in_cell += np.bincount(index_block.ravel(),
+                                        minlength=n_cells + 1)
+
+            # Different particles on each cell: distinct cells of each
+            # particle
+            index_block.sort(axis=1)
+            first_visit = np.ones(index_block.shape, dtype=bool)
+            first_visit[:, 1:] = index_block[:, 1:] != index_block[:, :-1]
+            mask_dif_id += np.bincount(index_block[first_visit],
+                                       minlength=n_cells + 1)
+
+        time_in_cell = time_in_cell[1:].reshape(n_tzyx).astype(float)
+        mask_dif_id = mask_dif_id[1:].reshape(n_tzyx).astype(float)
+        return time_in_cell, mask_dif_id
+
+    def init_stream(self, ds_input: xr.Dataset, geometry=None):
+        """
+        Residence time accumulator (see GridBased.init_stream). The
+        distinct (particle, cell) visits are kept as sorted flat keys, so
+        a particle visiting a cell in several chunks is counted once. The
+        new keys of the chunks are merged into them once they outgrow them
+        (see merge_visits), not chunk by chunk.
+        """
+        GridBased.init_stream(self, ds_input, geometry)
+        n_tzyx = list(map(np.size, self.centers))
+        self.time_in_cell = np.zeros(int(np.prod(n_tzyx)))
+        self.mask_dif_id = np.zeros(int(np.prod(n_tzyx)))
+        self.visits = np.zeros(0, dtype=np.int64)
+        self.new_visits = []
+        self.n_new_visits = 0
+        dt = np.array((ds_input.time[1]-ds_input.time[0]).values,
+                      dtype='timedelta64[s]')
+        self.dt = dt/np.timedelta64(1, 's')
+
+    def accumulate(self, index: np.array, particles: slice, steps: slice):
+        """ Add the visits of a chunk (see GridBased.accumulate). """
+        n_cells = self.time_in_cell.size
+        self.time_in_cell += np.bincount(index.ravel() + 1,
+                                         minlength=n_cells + 1)[1:]
+
+        # (particle, cell) keys of the chunk not visited before
+        particle = np.arange(particles.start, particles.stop, dtype=np.int64)
+        keys = (particle[np.newaxis, :]*n_cells + index)[index >= 0]
+        keys = sorted_unique(keys)
+        position = np.searchsorted(self.visits, keys)
+        visited = np.zeros(keys.size, dtype=bool)
+        inside = position < self.visits.size
+        visited[inside] = self.visits[position[inside]] == keys[inside]
+        self.new_visits.append(keys[~visited])
+        self.n_new_visits += self.new_visits[-1].size
+        if self.n_new_visits > max(self.visits.size, VISITS_MERGE_SIZE):
+            self.merge_visits()
+
+    def merge_visits(self):
+        """
+        Merge the new (particle, cell) keys of the chunks into the sorted
+        visits (one insertion of all of them) and count the distinct
+        particles of each cell. The new keys were not in the visits when
+        they were added, they can only be repeated between chunks.
+        """
+        if len(self.new_visits) == 0:
+            return
+        new_keys = sorted_unique(np.concatenate(self.new_visits))
+        self.new_visits, self.n_new_visits = [], 0
+        self.mask_dif_id += np.bincount(new_keys % self.mask_dif_id.size,
+                                        minlength=self.mask_dif_id.size)
+        self.visits = np.insert(self.visits,
+                                np.searchsorted(self.visits, new_keys),
+                                new_keys)
+
+    def discard(self, index: np.array, n_steps: int = None):
+        """ Remove the visits of particles (see GridBased.discard). """
+        time_in_cell, mask_dif_id = self.count_index(index)
+        if n_steps is not None:
+            time_in_cell *= n_steps
+        self.time_in_cell -= time_in_cell.ravel()
+        self.mask_dif_id -= mask_dif_id.ravel()
+
+    def get_stream_output(self, ds_input: xr.Dataset) -> xr.Dataset:
+        """ Residence time dataset (see GridBased.get_stream_output). """
+        self.merge_visits()
+        n_tzyx = list(map(np.size, self.centers))
+        residence_time = (self.time_in_cell*self.dt/self.mask_dif_id)
+        ds_output = self.init_dataset(ds_input)
+        self.to_dataset(ds_output, residence_time.reshape(n_tzyx))
+        return ds_output
+
+    def get_residence_time(self, ds_input: xr.Dataset, geometry=None,
+                           cell_index=None) -> xr.Dataset:
         """
         Get the residence time and append the result to the input dataset.
 
         Args:
             ds_input (xr.Dataset): Input dataset with particle positions.
+            geometry (GridGeometry, optional): cached grid geometry.
+            cell_index (CellIndex, optional): shared cell index cache.
 
         Returns:
             ds_output (xr.Dataset): Output dataset with concentrations.
 
         """
-        self.init_grid(ds_input)
+        self.init_grid(ds_input, geometry)
         ds_output = self.init_dataset(ds_input)
-        resd = self.get_counts(ds_input)
+        resd = self.get_counts(ds_input, cell_index)
         self.to_dataset(ds_output, resd)
         return ds_output
+
+
+def sorted_unique(keys: np.array) -> np.array:
+    """ Sorted distinct values of an array, sorted in place (np.unique
+    without its copy and hashing of the keys). """
+    keys.sort()
+    distinct = np.ones(keys.size, dtype=bool)
+    distinct[1:] = keys[1:] != keys[:-1]
+    return keys[distinct]
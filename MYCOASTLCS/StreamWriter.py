@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+""" StreamWriter module. It writes netCDF outputs piece by piece, so the
+fields computed by blocks (time blocks, tiles, files) can be stored as soon
+as they are ready without holding the whole output in memory.
+
+The file is created with the coordinates of a template dataset and the
+variables are then written by slices using netCDF4. Datasets can also be
+appended along an unlimited dimension (e.g. time), so several steps are
+merged into one file without holding all of them in memory. The contiguous
+ragged arrays indexed by that dimension (a count variable with the
+sample_dimension attribute, as the LCS ridge points) are appended along
+their sample dimension.
+"""
+
+import numpy as np
+import xarray as xr
+import netCDF4
+
+
+class StreamWriter:
+
+    def __init__(self, filename: str):
+        """
+        StreamWriter initializer.
+
+        Args:
+            filename (str): Path to the output netCDF file.
+
+        Returns:
+            None.
+
+        """
+        self.filename = filename
+        self.nc = None
+
+    def create(self, ds_template: xr.Dataset):
+        """
+        Create the output file with the coordinates of a template dataset.
+
+        Args:
+            ds_template (xr.Dataset): Dataset with the output coordinates.
+            Its data variables are also written.
+
+        Returns:
+            None.
+
+        """
+        ds_template.to_netcdf(self.filename)
+        self.nc = netCDF4.Dataset(self.filename, 'a')
+
+    def open(self):
+        """Open an existing output file to write or append data."""
+        self.nc = netCDF4.Dataset(self.filename, 'a')
+
+    def add_variable(self, name: str, dims: tuple, dtype='f8',
+                     attrs: dict = None):
+        """
+        Define a new variable (filled with NaN) in the output file.
+
+        Args:
+            name (str): Variable name.
+            dims (tuple): Dimension names of the variable.
+            dtype (str, optional): netCDF data type. Default 'f8'.
+            attrs (dict, optional): Variable attributes.
+
+        Returns:
+            None.
+
+        """
+        fill_value = np.nan if np.dtype(dtype).kind == 'f' else None
+        var = self.nc.createVariable(name, dtype, dims, fill_value=fill_value)
+        if attrs:
+            var.setncatts(attrs)
+
+    def write(self, name: str, data: np.array, index: tuple = ()):
+        """
+        Write a block of data in a variable.
+
+        Args:
+            name (str): Variable name.
+            data (np.array): Block of data.
+            index (tuple, optional): Slices of the block in the variable.
+            Default, the whole variable.
+
+        Returns:
+            None.
+
+        """
+        if len(index) == 0:
+            index = Ellipsis
+        self.nc.variables[name][index] = data
+        self.nc.sync()
+
+    def append(self, ds_step: xr.Dataset, dim: str = 'time'):
+        """
+        Append a dataset along an unlimited dimension. The file is created
+        with the first dataset; the variables without that dimension (or a
+        sample dimension of the ragged arrays indexed by it, see
+        get_sample_dims) are only written then. The dates along the
+        dimension are stored as float64 seconds since the first date, so
+        the later steps (e.g. sub-daily steps of the next files) are stored
+        exactly.
+
+        Args:
+            ds_step (xr.Dataset): Dataset to append.
+            dim (str, optional): Unlimited dimension. Default 'time'.
+
+        Returns:
+            None.
+
+        """
+        sample_dims = get_sample_dims(ds_step, dim)
+        if self.nc is None:
+            encoding = {}
+            for name, var in ds_step.variables.items():
+                if (dim in var.dims) and \
+                        np.issubdtype(var.dtype, np.datetime64):
+                    t0 = np.datetime_as_string(var.values.min(), unit='s')
+                    encoding[name] = {'units': 'seconds since ' +
+                                      t0.replace('T', ' '),
+                                      'dtype': 'float64'}
+            ds_step.to_netcdf(self.filename,
+                              unlimited_dims=[dim] + sample_dims,
+                              encoding=encoding)
+            self.nc = netCDF4.Dataset(self.filename, 'a')
+            return
+
+        start = {append_dim: len(self.nc.dimensions[append_dim])
+                 for append_dim in [dim] + sample_dims}
+        for name, var in ds_step.variables.items():
+            append_dims = [append_dim for append_dim in [dim] + sample_dims
+                           if append_dim in var.dims]
+            if len(append_dims) == 0:
+                continue
+            axis = var.dims.index(append_dims[0])
+            if var.shape[axis] == 0:
+                continue
+            i0 = start[append_dims[0]]
+            index = (slice(None),)*axis + (slice(i0, i0 + var.shape[axis]),)
+            data = var.values
+            if np.issubdtype(data.dtype, np.datetime64):
+                nc_var = self.nc.variables[name]
+                data = np.asarray(netCDF4.date2num(
+                    data.astype('datetime64[us]').tolist(), nc_var.units,
+                    getattr(nc_var, 'calendar', 'standard')))
+                if np.any(data.astype(nc_var.dtype) != data):
+                    raise ValueError('Dates of ' + name + ' can not be stored '
+                                     'exactly in ' + self.filename + ' (' +
+                                     nc_var.units + ', ' + str(nc_var.dtype) +
+                                     ')')
+            self.nc.variables[name][index] = data
+        self.nc.sync()
+
+    def close(self):
+        """Close the output file."""
+        if self.nc is not None:
+            self.nc.close()
+            self.nc = None
+
+
+def get_sample_dims(ds: xr.Dataset, dim: str = 'time') -> list:
+    """
+    Sample dimensions of the contiguous ragged arrays of a dataset indexed
+    by dim: the sample_dimension attribute of their count variables.
+
+    Args:
+        ds (xr.Dataset): Dataset.
+        dim (str, optional): Dimension of the count variables. Default
+        'time'.
+
+    Returns:
+        sample_dims (list): Sample dimension names.
+
+    """
+    return [ds[name].attrs['sample_dimension'] for name in ds.data_vars
+            if (dim in ds[name].dims) and
+            ('sample_dimension' in ds[name].attrs)]
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+""" Streaming module. Time-chunked execution of the grid based measures
+(CONC, RESD) for trajectory files too long to be gridded in memory at once.
+
+The positions are read from the input file in chunks of time_chunk
+timesteps, binned once per bins configuration and their cell index is
+passed to the accumulator of each measure (see GridBased.init_stream), so
+the memory is set by the cells and the chunk instead of the particles x
+timesteps of the whole trajectories:
+
+    - CONC: counts per timestep and cell (the output).
+    - RESD: time in cell, particles per cell and the distinct
+      (particle, cell) visits.
+
+The land mask (points that never moved) is only known at the end of the
+trajectories of each file. It is accumulated in the same pass (one bit per
+particle) and the still particles are removed from the measures at the end.
+The "domain" bins need the extent of the positions before the binning, so
+they are obtained with a first pass.
+
+The positions of some timesteps (the FTLE ones, in the fused mode of
+Common) can be kept from the same pass, so the input is traversed once for
+all the stages.
+
+The outputs are identical to the in-memory computation.
+"""
+
+import numpy as np
+import xarray as xr
+from .ArrayToGrid import squeeze_z_dim
+
+VARS_LABELS = ['z', 'y', 'x']
+STREAM_TIME_CHUNK = 64
+
+
+def iter_time_chunks(ds: xr.Dataset, time_chunk: int):
+    """
+    Read the positions of a Lagrangian dataset by chunks of timesteps.
+
+    Args:
+        ds (xr.Dataset): Lagrangian dataset [time, particle].
+        time_chunk (int): timesteps of each chunk.
+
+    Yields:
+        steps (slice): timesteps of the chunk.
+        positions (list): z, y, x arrays [time, particle] of the chunk.
+
+    """
+    for i0 in range(0, ds.time.size, time_chunk):
+        steps = slice(i0, min(i0 + time_chunk, ds.time.size))
+        ds_chunk = ds[VARS_LABELS].isel(time=steps)
+        yield steps, [ds_chunk[var].transpose('time', ...).values
+                      for var in VARS_LABELS]
+
+
+class StreamedGridBased:
+
+    def __init__(self, grid_shape: list, time_chunk: int, measures: list):
+        """
+        Streamed grid based measures initializer.
+
+        Args:
+            grid_shape (list): grid of shape of points [nz, ny, nx].
+            time_chunk (int): timesteps read at once.
+            measures (list): GridBased measures (Concentrations,
+            ResidenceTime) to accumulate.
+
+        Returns:
+            None.
+
+        """
+        self.grid_shape = list(grid_shape)
+        self.time_chunk = int(time_chunk)
+        self.measures = measures
+
+    def get_grid_coords(self, ds: xr.Dataset, geometry=None) -> xr.Dataset:
+        """
+        Coordinates of the grid structured dataset (see ArrayToGrid), from
+        the initial positions or the grid geometry.
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+            geometry (GridGeometry, optional): cached grid geometry.
+
+        Returns:
+            ds_coords (xr.Dataset): Dataset with time, z0, y0, x0.
+
+        """
+        if (geometry is not None) and (geometry.coords is not None):
+            z0, y0, x0 = geometry.coords
+        else:
+            r0 = [ds[var].isel(time=0).values.reshape(self.grid_shape)
+                  for var in VARS_LABELS]
+            z0, y0, x0 = r0[0][:, 0, 0], r0[1][0, :, 0], r0[2][0, 0, :]
+            if geometry is not None:
+                geometry.set_coords(z0, y0, x0)
+        ds_coords = xr.Dataset(coords={'time': ('time', ds.time.data),
+                                       'z0': ('z0', z0),
+                                       'y0': ('y0', y0),
+                                       'x0': ('x0', x0)})
+        return squeeze_z_dim(ds_coords)
+
+    def get_land_mask(self, ds: xr.Dataset, extent: bool = False):
+        """
+        Land mask (packed bitmask of the points that never moved, see
+        ArrayToGrid.get_land_mask) obtained by chunks of timesteps, and the
+        extent of the positions that moved.
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+            extent (bool, optional): also get the extent of the positions.
+
+        Returns:
+            land_mask (dict): packed bitmask of each variable.
+            r_min, r_max (dict): minimum and maximum of each variable
+            (None if extent is False).
+
+        """
+        print('-> STRM  >> Land mask by chunks of', self.time_chunk,
+              'timesteps')
+        r0, moved, r_min, r_max = None, None, None, None
+        for steps, positions in iter_time_chunks(ds, self.time_chunk):
+            if r0 is None:
+                r0 = [r[0] for r in positions]
+                moved = [np.zeros(r.shape, dtype=bool) for r in r0]
+                if extent is True:
+                    r_min = [np.full(r.shape, np.inf) for r in r0]
+                    r_max = [np.full(r.shape, -np.inf) for r in r0]
+            for i, r in enumerate(positions):
+                moved[i] |= (r != r0[i]).any(axis=0)
+                if extent is True:
+                    np.fmin(r_min[i], np.nanmin(r, axis=0), out=r_min[i])
+                    np.fmax(r_max[i], np.nanmax(r, axis=0), out=r_max[i])
+        land_mask = {var: np.packbits(~moved[i], axis=None)
+                     for i, var in enumerate(VARS_LABELS)}
+        if extent is False:
+            return land_mask, None, None
+        # NaN if no position moved, as the minimum of the masked positions
+        r_min = {var: r_min[i][moved[i]].min() if moved[i].any() else np.nan
+                 for i, var in enumerate(VARS_LABELS)}
+        r_max = {var: r_max[i][moved[i]].max() if moved[i].any() else np.nan
+                 for i, var in enumerate(VARS_LABELS)}
+        return land_mask, r_min, r_max
+
+    def discard_still(self, ds: xr.Dataset, r0: list, moved: list):
+        """
+        Remove from the measures the particles of the land mask (see
+        ArrayToGrid.get_land_mask), once it is known at the end of a single
+        pass in which they were accumulated.
+
+        A particle is out of a measure if one of the positions of its bins
+        never moved. If none of them moved it stayed in its initial cell and
+        it is removed from its initial position. Otherwise (e.g. a 3D
+        particle moving only horizontally) its positions are read again.
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+            r0 (list): z, y, x initial positions.
+            moved (list): z, y, x flags of the particles that moved.
+
+        Returns:
+            None.
+
+        """
+        n_time = ds.time.size
+        particle_dim = [dim for dim in ds.x.dims if dim != 'time'][0]
+        for measure in self.measures:
+            n_dims = len(measure.bins)
+            still = [~flag for flag in moved[-n_dims:]]
+            fully = np.logical_and.reduce(still)
+            partially = np.logical_or.reduce(still) & ~fully
+            if fully.any():
+                index = measure.get_cell_index(
+                    *[r[np.newaxis, fully] for r in r0])
+                measure.discard(index, n_time)
+            if partially.any():
+                print('-> STRM  >> Reading', np.count_nonzero(partially),
+                      'partially still particles')
+                ds_still = ds[VARS_LABELS].isel(
+                    {particle_dim: np.flatnonzero(partially)})
+                index = measure.get_cell_index(
+                    *[ds_still[var].transpose('time', ...).values
+                      for var in VARS_LABELS])
+                measure.discard(index)
+
+    def run(self, ds: xr.Dataset, geometry=None, capture: list = None):
+        """
+        Compute the measures chunk by chunk.
+
+        The input is read once. The still particles are accumulated and
+        removed at the end (discard_still), except for the "domain" bins,
+        which need a first pass for the extent of the positions
+        (get_land_mask).
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+            geometry (GridGeometry, optional): cached grid geometry. Its
+            coordinates and bins are reused, or stored in it.
+            capture (list, optional): time indices whose positions are kept
+            from the same pass (e.g. the FTLE timesteps).
+
+        Returns:
+            ds_outputs (list): Output dataset of each measure.
+            ds_captured (xr.Dataset): Lagrangian dataset with the captured
+            timesteps (None without capture).
+            land_mask (dict): land mask of all the timesteps.
+
+        """
+        n_time = ds.time.size
+        n_particles = int(np.prod(self.grid_shape))
+        ds_coords = self.get_grid_coords(ds, geometry)
+
+        # Land mask and extent (only for the "domain" bins)
+        extent = any([measure.bins_option == 'domain'
+                      for measure in self.measures])
+        land_mask = None
+        r_min, r_max = None, None
+        if extent is True:
+            land_mask, r_min, r_max = self.get_land_mask(ds, extent)
+        still = None
+        if land_mask is not None:
+            still = [np.unpackbits(land_mask[var],
+                                   count=n_particles).astype(bool)
+                     for var in VARS_LABELS]
+
+        ds_bins = ds_coords
+        if extent is True:
+            ds_bins = ds_coords.assign({var: ('extent', [r_min[var],
+                                                         r_max[var]])
+                                        for var in VARS_LABELS})
+        for measure in self.measures:
+            measure.init_stream(ds_bins, geometry)
+
+        capture = [] if capture is None else list(capture)
+        captured = [[] for var in VARS_LABELS]
+        r0, moved = None, None
+        particles = slice(0, n_particles)
+        for steps, positions in iter_time_chunks(ds, self.time_chunk):
+            print('-> STRM  >> Timesteps', steps.start, '-', steps.stop,
+                  'of', n_time)
+            rows = [i - steps.start for i in capture
+                    if steps.start <= i < steps.stop]
+            for i, r in enumerate(positions):
+                captured[i].append(r[rows])
+            if still is None:
+                # Land mask from the same pass (see discard_still)
+                if r0 is None:
+                    r0 = [r[0].copy() for r in positions]
+                    moved = [np.zeros(r.shape, dtype=bool) for r in r0]
+                for i, r in enumerate(positions):
+                    moved[i] |= (r != r0[i]).any(axis=0)
+            else:
+                for i, r in enumerate(positions):
+                    if still[i].any():
+                        if (r.dtype.kind != 'f') or (not r.flags.writeable):
+                            r = positions[i] = r.astype(float)
+                        r[:, still[i]] = np.nan
+            # Cell index shared by the measures with the same bins
+            index = {}
+            for measure in self.measures:
+                key = measure.get_bins_hash()
+                if key not in index:
+                    nt = positions[0].shape[0]
+                    index[key] = measure.get_cell_index(
+                        *[r.reshape(nt, -1) for r in positions])
+                measure.accumulate(index[key], particles, steps)
+
+        if still is None:
+            land_mask = {var: np.packbits(~moved[i], axis=None)
+                         for i, var in enumerate(VARS_LABELS)}
+            self.discard_still(ds, r0, moved)
+
+        ds_captured = None
+        if len(capture) > 0:
+            particle_dim = [dim for dim in ds.x.dims if dim != 'time'][0]
+            ds_captured = xr.Dataset(
+                {var: (('time', particle_dim), np.concatenate(captured[i]))
+                 for i, var in enumerate(VARS_LABELS)},
+                coords={'time': ds.time.values[capture]})
+
+        return [measure.get_stream_output(ds_coords)
+                for measure in self.measures], ds_captured, land_mask
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+""" Tiling module. Out-of-core execution of the FTLE and LCS stages for
+seeding grids too large to be gridded in memory at once.
+
+The grid is split in tiles along its slowest axis (y0 for 2D grids, z0 for
+3D grids), so every tile is a contiguous range of particles in the input
+file. Each tile is read with a halo of extra rows:
+
+    - 1 row for the np.gradient stencil of the flow map (FTLE).
+    - LCS.get_halo() rows for the Gaussian filter and the finite
+      differences of the FTLE Hessian (LCS).
+
+               halo  |-----------------|
+               tile  |=================|  <- rows written to the output
+               halo  |-----------------|
+
+Only the rows of the tile are kept, so the stitched fields are identical
+to the untiled computation. The thresholds and the connected areas of the
+LCS mask are global and they are obtained from the stitched 2D (or 3D)
+fields.
+"""
+
+import numpy as np
+import xarray as xr
+from .ArrayToGrid import ArrayToGrid
+from .FTLE import FTLE
+from .LCS import LCS
+
+
+def get_tiles(n: int, tile_size: int, halo: int) -> list:
+    """
+    Split an axis in tiles with a halo on each side.
+
+    Args:
+        n (int): Axis size.
+        tile_size (int): Number of points of each tile.
+        halo (int): Number of extra points on each side of the tile.
+
+    Returns:
+        tiles (list): tuples (outer, inner, target). outer: slice to read
+        (tile + halo), inner: slice of the tile inside the outer block,
+        target: slice of the tile in the whole axis.
+
+    """
+    tiles = []
+    for i0 in range(0, n, tile_size):
+        i1 = min(i0 + tile_size, n)
+        lo, hi = max(i0 - halo, 0), min(i1 + halo, n)
+        tiles.append((slice(lo, hi), slice(i0 - lo, i1 - lo), slice(i0, i1)))
+    return tiles
+
+
+class TiledFTLE:
+
+    def __init__(self, grid_shape: list, tile_size: int, ftle_setup: dict,
+                 lcs_setup: dict = None):
+        """
+        Tiled FTLE/LCS initializer.
+
+        Args:
+            grid_shape (list): grid of shape of points [nz, ny, nx].
+            tile_size (int): Number of rows (y0, or z0 layers for 3D grids)
+            per tile.
+            ftle_setup (dict): "FTLE" setup of the json file.
+            lcs_setup (dict, optional): "LCS" setup of the json file.
+
+        Returns:
+            None.
+
+        """
+        self.grid_shape = list(grid_shape)
+        self.tile_size = int(tile_size)
+        self.ftle_setup = ftle_setup
+        self.lcs_setup = lcs_setup
+        # Tiles along z0 for 3D grids, along y0 for 2D grids.
+        self.axis = 0 if self.grid_shape[0] > 1 else 1
+        self.axis_label = ['z0', 'y0', 'x0'][self.axis]
+
+    def get_halo(self) -> int:
+        """ Halo (rows) needed around each tile. """
+        halo = 1
+        if self.lcs_setup is not None:
+            halo += LCS(**self.lcs_setup).get_halo()
+        return halo
+
+    def read_tile(self, ds: xr.Dataset, outer: slice,
+                  land_mask: dict = None) -> xr.Dataset:
+        """
+        Read and grid the particles of a tile (with halo).
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle].
+            outer (slice): rows of the tile along the tiling axis.
+            land_mask (dict, optional): land mask of the whole grid (see
+            ArrayToGrid.get_land_mask). Default, from the timesteps of ds.
+
+        Returns:
+            grid_tile (xr.Dataset): grid structured dataset of the tile.
+
+        """
+        particle_dim = [dim for dim in ds.x.dims if dim != 'time'][0]
+        points_per_row = int(np.prod(self.grid_shape[self.axis + 1:]))
+        particles = slice(outer.start*points_per_row,
+                          outer.stop*points_per_row)
+        tile_shape = list(self.grid_shape)
+        tile_shape[self.axis] = outer.stop - outer.start
+        ds_tile = ds.isel({particle_dim: particles})
+        if land_mask is not None:
+            n_particles = int(np.prod(self.grid_shape))
+            land_mask = {var: np.packbits(np.unpackbits(
+                mask, count=n_particles)[particles]) for var, mask in
+                land_mask.items()}
+        return ArrayToGrid().array_to_grid(ds_tile, tile_shape,
+                                           land_mask=land_mask)
+
+    def get_ftle_lcs(self, ds: xr.Dataset,
+                     land_mask: dict = None) -> xr.Dataset:
+        """
+        Compute the FTLE (and LCS) tile by tile.
+
+        Args:
+            ds (xr.Dataset): Lagrangian dataset [time, particle], lazily
+            opened so only the tiles are read.
+            land_mask (dict, optional): land mask of the whole grid (see
+            ArrayToGrid.get_land_mask). Default, from the timesteps of ds.
+
+        Returns:
+            ds_output (xr.Dataset): Dataset with the stitched FTLE and LCS
+            fields.
+
+        """
+        n = self.grid_shape[self.axis]
+        tiles = get_tiles(n, self.tile_size, self.get_halo())
+        print('-> TILES >>', len(tiles), 'tiles of', self.tile_size,
+              self.axis_label, 'rows, halo:', self.get_halo())
+
+        if self.lcs_setup is not None:
+            lcs = LCS(**self.lcs_setup)
+
+        axis_values = np.zeros(n)
+        fields = {}
+        for k, (outer, inner, target) in enumerate(tiles):
+            print('-> TILES >> Tile', k + 1, 'of', len(tiles))
+            grid_tile = self.read_tile(ds, outer, land_mask)
+            FTLE(**self.ftle_setup).get_ftle(grid_tile)
+            name = [var for var in ['FTLE_forward', 'FTLE_backward']
+                    if var in grid_tile][0]
+            ftle_tile = grid_tile[name]
+            axis = ftle_tile.dims.index(self.axis_label)
+            crop = [slice(None)]*ftle_tile.ndim
+            crop[axis] = inner
+            crop = tuple(crop)
+            if name not in fields:
+                shape = list(ftle_tile.shape)
+                shape[axis] = n
+                fields[name] = np.zeros(shape)
+                if self.lcs_setup is not None:
+                    fields['EVal'] = np.zeros(shape)
+                    fields['ridge'] = np.zeros(shape)
+                ds_output = grid_tile.coords.to_dataset().drop_vars(
+                    self.axis_label)
+                dims = ftle_tile.dims
+                # 2D or 3D fields, with a leading integration_time dim.
+                spatial_ndim = 3 if 'z0' in dims else 2
+            target_crop = list(crop)
+            target_crop[axis] = target
+            target_crop = tuple(target_crop)
+            fields[name][target_crop] = ftle_tile.values[crop]
+            axis_values[target] = grid_tile[self.axis_label].values[inner]
+
+            if self.lcs_setup is not None:
+                ftle_filled = ftle_tile.fillna(0).values
+                ftle_filled = ftle_filled.reshape(
+                    (-1,) + ftle_filled.shape[-spatial_ndim:])
+                EVal = np.zeros_like(ftle_filled)
+                ridge = np.zeros_like(ftle_filled)
+                for i in range(0, ftle_filled.shape[0]):
+                    EVal[i], ridge[i] = lcs.get_hessian_ridges(ftle_filled[i])
+                shape = ftle_tile.shape
+                fields['EVal'][target_crop] = EVal.reshape(shape)[crop]
+                fields['ridge'][target_crop] = ridge.reshape(shape)[crop]
+
+        ds_output = ds_output.assign_coords({self.axis_label: axis_values})
+        ds_output[name] = (dims, fields[name])
+
+        if self.lcs_setup is not None:
+            ftle_filled = ds_output[name].fillna(0).values
+            EVal = fields['EVal']
+            if 'integration_time' not in dims:
+                ridge_mask = lcs.get_ridge_mask(ftle_filled, EVal)
+            else:
+                ridge_mask = np.stack([lcs.get_ridge_mask(ftle_filled[i],
+                                                          EVal[i])
+                                       for i in range(0, EVal.shape[0])])
+            lcs.to_dataset(ds_output, ridge_mask)
+            if lcs.ridge_points_flag:
+                lcs.ridge_points_to_dataset(ds_output, ridge_mask,
+                                            fields['ridge'])
+        return ds_output
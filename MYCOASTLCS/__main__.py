@@ -48,17 +48,46 @@ def main():
                            dest="input_file",
                            help="input netcdf file/s files",
                            metavar="input_file")
+    argParser.add_argument("-b", "--backward",
+                           dest="backward_file",
+                           help="input netcdf file/s of the backward run, "
+                                "paired with the (forward) input files",
+                           metavar="backward_file")
     argParser.add_argument("-o", "--output",
                            dest="output_file",
                            help="output netcdf file with desire fields",
                            metavar="output_file")
+    argParser.add_argument("--workers",
+                           dest="n_workers",
+                           type=int,
+                           help="number of processes for multi-file runs",
+                           metavar="N")
+    argParser.add_argument("--watch",
+                           dest="watch",
+                           action="store_true",
+                           help="poll the input files and process the new ones")
+    argParser.add_argument("--interval",
+                           dest="interval",
+                           type=float,
+                           default=60.,
+                           help="seconds between polls of the watch mode",
+                           metavar="S")
     args = argParser.parse_args()
 
     run = Common()
     run.read_json(args.case_json)
-    run.run_ftle_lcs(args.input_file, args.output_file)
+    if args.n_workers is not None:
+        run.n_workers = args.n_workers
+    if args.watch:
+        run.watch(args.input_file, args.output_file, args.interval,
+                  args.backward_file)
+    else:
+        run.run_ftle_lcs(args.input_file, args.output_file,
+                         args.backward_file)
 
     print('Finish!\n\n')
 
 
-main()
+# Guarded so the worker processes can import this module
+if __name__ == '__main__':
+    main()
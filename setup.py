@@ -16,5 +16,9 @@ setuptools.setup(
               "scikit-image",
               "netcdf4"
       ],
+    extras_require={
+              "lazy": ["dask"],
+              "stats": ["pandas"]
+      },
     python_requires='>=3.6',
 )
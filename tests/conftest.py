@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+""" Synthetic Lagrangian inputs (double gyre) for the MYCOASTLCS tests. """
+
+import json
+import numpy as np
+import pytest
+import xarray as xr
+
+
+def double_gyre(grid_shape=(1, 12, 24), nt=7, dt=0.1, t0=0., hours=6.,
+                land=None, spherical=False, backward=False,
+                start='2020-01-01'):
+    """
+    Trajectories of a grid of particles in the double gyre flow.
+
+    Args:
+        grid_shape (tuple): grid of shape of points [nz, ny, nx].
+        nt (int): number of timesteps.
+        dt (float): flow time between timesteps.
+        t0 (float): initial flow time.
+        hours (float): hours between timesteps (time coordinate).
+        land (np.array, optional): flat mask of the particles that never
+        move.
+        spherical (bool): lon/lat positions (degrees).
+        backward (bool): backward in time.
+        start (str): initial time.
+
+    Returns:
+        ds (xr.Dataset): Lagrangian dataset [time, particles].
+
+    """
+    nz, ny, nx = grid_shape
+    z0 = np.linspace(0, -10, nz) if nz > 1 else np.zeros(1)
+    Z, Y, X = np.meshgrid(z0, np.linspace(0, 1, ny), np.linspace(0, 2, nx),
+                          indexing='ij')
+    x, y, z = X.ravel().copy(), Y.ravel().copy(), Z.ravel().copy()
+    A, eps, om = 0.1, 0.25, 2*np.pi/10
+    sign = -1 if backward else 1
+    xs, ys, zs = [x.copy()], [y.copy()], [z.copy()]
+    t = t0
+    for k in range(1, nt):
+        for s in range(0, 10):
+            h = sign*dt/10
+            a = eps*np.sin(om*t)
+            b = 1 - 2*a
+            f = a*x**2 + b*x
+            u = -np.pi*A*np.sin(np.pi*f)*np.cos(np.pi*y)
+            v = np.pi*A*np.cos(np.pi*f)*np.sin(np.pi*y)*(2*a*x + b)
+            x, y = x + h*u, y + h*v
+            z = z + h*0.05*np.sin(x)*(nz > 1)
+            t += h
+        xs.append(x.copy())
+        ys.append(y.copy())
+        zs.append(z.copy())
+    xs, ys, zs = np.array(xs), np.array(ys), np.array(zs)
+    if land is not None:
+        for r in (xs, ys, zs):
+            r[:, land] = r[0, land]
+    if spherical:
+        xs, ys = -9 + 0.5*xs, 43 + 0.5*ys
+    time = np.datetime64(start, 's') + \
+        (sign*np.arange(nt)*hours*3600).astype('timedelta64[s]')
+    return xr.Dataset({'x': (('time', 'particles'), xs),
+                       'y': (('time', 'particles'), ys),
+                       'z': (('time', 'particles'), zs)},
+                      coords={'time': time})
+
+
+def land_box(grid_shape, x_min, y_min):
+    """ Flat mask of the particles with x0 > x_min and y0 > y_min. """
+    nz, ny, nx = grid_shape
+    Z, Y, X = np.meshgrid(np.zeros(nz), np.linspace(0, 1, ny),
+                          np.linspace(0, 2, nx), indexing='ij')
+    return ((X > x_min) & (Y > y_min)).ravel()
+
+
+def write_setup(path, setup):
+    """ Write a setup json file. """
+    with open(path, 'w') as json_file:
+        json.dump(setup, json_file)
+    return str(path)
+
+
+@pytest.fixture
+def setup_2d():
+    """ Setup with all the stages for a [1, 12, 24] grid. """
+    return {'common': {'model': 'pylag', 'grid_shape': [1, 12, 24]},
+            'FTLE': {'spherical_flag': 0, 'integration_time_index': -1},
+            'LCS': {'eval_thrsh': 'infer', 'ftle_thrsh': 'infer',
+                    'area_thrsh': 2, 'nr_neighb': 2,
+                    'ridge_points_flag': 0},
+            'CONC': {'bins_option': 'origin', 'nbins': []},
+            'RESD': {'bins_option': 'origin', 'nbins': []}}
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import xarray as xr
+from MYCOASTLCS.FTLE import FTLE, EARTH_RADIUS
+from conftest import double_gyre
+
+
+def to_grid(ds, grid_shape):
+    """ Grid structured dataset [time, z0, y0, x0] without land mask. """
+    nt = ds.time.size
+    r = {var: (('time', 'z0', 'y0', 'x0'),
+               ds[var].values.reshape([nt] + list(grid_shape)))
+         for var in ['x', 'y', 'z']}
+    r0 = [ds[var].values[0].reshape(grid_shape) for var in ['z', 'y', 'x']]
+    return xr.Dataset(r, coords={'time': ds.time.values,
+                                 'z0': r0[0][:, 0, 0],
+                                 'y0': r0[1][0, :, 0],
+                                 'x0': r0[2][0, 0, :]})
+
+
+def test_2d_cartesian_matches_loop():
+    grid_shape = (1, 12, 24)
+    ds = to_grid(double_gyre(grid_shape), grid_shape)
+    ftle = FTLE(0, -1)
+    np.testing.assert_allclose(ftle.get_ftle_2d_cartesian(ds),
+                               ftle.get_ftle_2d_cartesian_loop(ds),
+                               rtol=1e-10)
+
+
+def test_2d_cartesian_analytic():
+    # Linear strain x_T = exp(s)*x0, y_T = exp(-s)*y0: FTLE = s/T.
+    T, s = 7200., 0.5
+    y0, x0 = np.linspace(0, 1, 6), np.linspace(0, 2, 8)
+    Y, X = np.meshgrid(y0, x0, indexing='ij')
+    time = np.array(['2020-01-01T00', '2020-01-01T02'], dtype='datetime64[ns]')
+    dims = ('time', 'y0', 'x0')
+    ds = xr.Dataset({'x': (dims, np.stack([X, np.exp(s)*X])),
+                     'y': (dims, np.stack([Y, np.exp(-s)*Y]))},
+                    coords={'time': time, 'y0': y0, 'x0': x0})
+    np.testing.assert_allclose(FTLE(0, -1).get_ftle_2d_cartesian(ds), s/T,
+                               rtol=1e-12)
+
+
+@pytest.mark.parametrize('memory_budget_mb', [1024., 1e-6])
+def test_3d_cartesian_matches_loop(memory_budget_mb):
+    # A tiny budget processes the domain one z-slab at a time.
+    grid_shape = (4, 8, 10)
+    ds = to_grid(double_gyre(grid_shape, nt=4), grid_shape)
+    ds['x'][-1, 2, 3, 4] = np.nan
+    ftle = FTLE(0, -1, memory_budget_mb=memory_budget_mb)
+    ftle_3d = ftle.get_ftle_3d_cartesian(ds)
+    np.testing.assert_allclose(ftle_3d, ftle.get_ftle_3d_cartesian_loop(ds),
+                               rtol=1e-10)
+    assert np.isnan(ftle_3d[2, 3, 4]) and np.isfinite(ftle_3d[0]).all()
+
+
+def test_3d_spherical_matches_loop():
+    grid_shape = (3, 8, 10)
+    ds = to_grid(double_gyre(grid_shape, nt=4, spherical=True), grid_shape)
+    ftle = FTLE(1, -1)
+    np.testing.assert_allclose(ftle.get_ftle_3d_spherical(ds),
+                               ftle.get_ftle_3d_spherical_loop(ds),
+                               rtol=1e-10)
+
+
+@pytest.mark.parametrize('shear', [0., 10., 1000.])
+def test_3d_spherical_vertical_shear(shear):
+    # Eastward flow u = alpha*z: in meters the flow map is a simple shear
+    # F = [[1, 0, s], [0, 1, 0], [0, 0, 1]] with s = alpha*T, whose largest
+    # Cauchy Green eigenvalue is 1 + s**2/2 + s*sqrt(1 + s**2/4).
+    T = 3600.
+    z0 = np.array([-2., 0., 2.])
+    y0 = np.linspace(42., 44., 5)
+    x0 = np.linspace(-10., -8., 6)
+    Z, Y, X = np.meshgrid(z0, y0, x0, indexing='ij')
+    R = EARTH_RADIUS
+    x_T = X + shear*Z/(R*np.cos(Y*np.pi/180.))*180./np.pi
+    time = np.array(['2020-01-01T00', '2020-01-01T01'], dtype='datetime64[ns]')
+    dims = ('time', 'z0', 'y0', 'x0')
+    ds = xr.Dataset({'x': (dims, np.stack([X, x_T])),
+                     'y': (dims, np.stack([Y, Y])),
+                     'z': (dims, np.stack([Z, Z]))},
+                    coords={'time': time, 'z0': z0, 'y0': y0, 'x0': x0})
+    eigval = 1 + shear**2/2 + shear*np.sqrt(1 + shear**2/4)
+    expected = np.log(np.sqrt(eigval))/T
+    ftle = FTLE(1, -1)
+    for ftle_3d in [ftle.get_ftle_3d_spherical(ds),
+                    ftle.get_ftle_3d_spherical_loop(ds)]:
+        # Middle layer (z0 = 0): no lon/lat dependence of the displacement
+        np.testing.assert_allclose(ftle_3d[1], expected, rtol=1e-9,
+                                   atol=1e-15)
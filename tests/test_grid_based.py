@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from MYCOASTLCS.Concentrations import Concentrations
+from MYCOASTLCS.ResidenceTime import ResidenceTime
+from conftest import double_gyre
+
+UNIFORM = (np.ones(1), np.linspace(0, 1, 7), np.linspace(0, 1.5, 9))
+NON_UNIFORM = (np.ones(1), np.array([0., 0.1, 0.35, 0.5, 1.]),
+               np.array([0., 0.2, 0.3, 0.9, 1.1, 1.5]))
+
+
+def get_positions(bins):
+    """ Double gyre positions [time, particles] with NaN (land), positions
+    outside the bins and positions on the cell edges. """
+    ds = double_gyre((1, 12, 24), nt=6)
+    z, y, x = [ds[var].values.copy() for var in ['z', 'y', 'x']]
+    x[2, :5] = np.nan
+    y[:, 5] = np.nan
+    x[3, 10:10 + bins[2].size] = bins[2]
+    y[3, 10:10 + bins[1].size] = 0.5
+    y[4, 20:20 + bins[1].size] = bins[1]
+    return z, y, x
+
+
+def init_bins(grid, bins):
+    """ Sets the cell edges of a GridBased object. """
+    grid.bins = bins[1:] if bins[0].size <= 1 else bins
+    grid.get_centers()
+    return grid
+
+
+@pytest.mark.parametrize('bins', [UNIFORM, NON_UNIFORM])
+def test_concentrations_match_histogramdd(bins):
+    z, y, x = get_positions(bins)
+    conc = init_bins(Concentrations([], 'custom'), bins)
+    counts = conc.count_block(z, y, x)
+    expected = [np.histogramdd(np.c_[y[k], x[k]], bins=bins[1:])[0]
+                for k in range(0, x.shape[0])]
+    np.testing.assert_array_equal(counts, expected)
+    assert counts[3].sum() > 0
+
+
+@pytest.mark.parametrize('bins', [UNIFORM, NON_UNIFORM])
+def test_residence_time_counts_match_loop(bins):
+    z, y, x = get_positions(bins)
+    resd = init_bins(ResidenceTime([], 'custom'), bins)
+    time_in_cell, mask_dif_id = resd.count_block(z, y, x)
+    expected_time = np.zeros(time_in_cell.shape)
+    expected_visits = np.zeros(mask_dif_id.shape)
+    for p in range(0, x.shape[1]):
+        counts, _ = np.histogramdd(np.c_[y[:, p], x[:, p]], bins=bins[1:])
+        expected_time += counts
+        expected_visits += counts > 0
+    np.testing.assert_array_equal(time_in_cell, expected_time)
+    np.testing.assert_array_equal(mask_dif_id, expected_visits)
+    assert (expected_visits < expected_time).any()
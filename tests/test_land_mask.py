@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from MYCOASTLCS.Common import Common
+from conftest import double_gyre, land_box, write_setup
+
+
+def run_ftle(tmp_path, setup, ds, name='in.nc'):
+    """ FTLE/LCS of one input file with the outputs kept in memory. """
+    input_file = str(tmp_path / name)
+    ds.to_netcdf(input_file)
+    setup['common']['disk_or_mem'] = 'mem'
+    run = Common()
+    run.read_json(write_setup(tmp_path / 'setup.json', setup))
+    _, outputs = run.process_one_file(input_file)
+    return outputs
+
+
+def test_land_mask_from_read_timesteps(tmp_path, setup_2d):
+    # FTLE-only runs read the initial and the integration time index: the
+    # particles still at those timesteps are masked, even if they move in
+    # between. With CONC all the timesteps are read, so they are not.
+    setup = {key: setup_2d[key] for key in ['common', 'FTLE']}
+    setup['FTLE']['integration_time_index'] = 3
+    grid_shape = setup['common']['grid_shape']
+    land = land_box(grid_shape, 1.5, 0.6)
+    back = land_box(grid_shape, -1, 0.6) & ~land_box(grid_shape, 1.2, -1)
+    ds = double_gyre(grid_shape, nt=7, land=land)
+    for var in ['x', 'y']:
+        r = ds[var].values
+        r[3, back] = r[0, back]
+
+    ftle = run_ftle(tmp_path, setup, ds)['FTLE'].FTLE_forward.values
+    setup['CONC'] = setup_2d['CONC']
+    ftle_all = run_ftle(tmp_path, setup, ds)['FTLE'].FTLE_forward.values
+    shape = grid_shape[1:]
+    assert np.isnan(ftle[(land | back).reshape(shape)]).all()
+    assert np.isnan(ftle_all[land.reshape(shape)]).all()
+    assert np.isfinite(ftle_all[back.reshape(shape)]).any()
+    finite = np.isfinite(ftle)
+    assert finite.any()
+    np.testing.assert_array_equal(ftle[finite], ftle_all[finite])
+
+
+@pytest.mark.parametrize('stream_time_chunk', [None, 2])
+def test_land_mask_per_file(tmp_path, setup_2d, stream_time_chunk):
+    # Two files with the same seeding grid (same grid geometry) and a
+    # different land: the second file must not take the land mask of the
+    # first one.
+    import MYCOASTLCS.GridGeometry as GridGeometry
+    setup = {key: setup_2d[key] for key in ['common', 'FTLE', 'CONC',
+                                            'RESD']}
+    if stream_time_chunk is not None:
+        setup['common']['stream_time_chunk'] = stream_time_chunk
+    grid_shape = setup['common']['grid_shape']
+    land_1 = land_box(grid_shape, 1.5, 0.6)
+    land_2 = land_box(grid_shape, -1, 0.7) & ~land_1
+    GridGeometry._GEOMETRY_CACHE.clear()
+    run_ftle(tmp_path, setup, double_gyre(grid_shape, land=land_1), 'a.nc')
+    outputs = run_ftle(tmp_path, setup,
+                       double_gyre(grid_shape, land=land_2,
+                                   start='2020-01-03'), 'b.nc')
+    GridGeometry._GEOMETRY_CACHE.clear()
+    reference = run_ftle(tmp_path, setup,
+                         double_gyre(grid_shape, land=land_2,
+                                     start='2020-01-03'), 'c.nc')
+    for stage in ['FTLE', 'CONC', 'RESD']:
+        for var in reference[stage].data_vars:
+            np.testing.assert_array_equal(outputs[stage][var].values,
+                                          reference[stage][var].values)
+    ftle = outputs['FTLE'].FTLE_forward.values
+    assert np.isnan(ftle[land_2.reshape(grid_shape[1:])]).all()
+    assert np.isfinite(ftle[(land_1 & ~land_2).reshape(grid_shape[1:])]).any()
+
+
+@pytest.mark.parametrize('tile_size', [None, 5])
+def test_land_mask_backward(tmp_path, setup_2d, tile_size):
+    # Forward/backward pair with a different land: the backward FTLE is
+    # masked with the land of the backward file.
+    setup = {key: setup_2d[key] for key in ['common', 'FTLE']}
+    setup['FTLE']['integration_time_index'] = 3
+    if tile_size is not None:
+        setup['common']['tile_size'] = tile_size
+    grid_shape = setup['common']['grid_shape']
+    land_1 = land_box(grid_shape, 1.5, 0.6)
+    land_2 = land_box(grid_shape, -1, 0.7) & ~land_1
+    ds_backward = double_gyre(grid_shape, land=land_2, backward=True)
+    backward_file = str(tmp_path / 'backward.nc')
+    ds_backward.to_netcdf(backward_file)
+
+    input_file = str(tmp_path / 'forward.nc')
+    double_gyre(grid_shape, land=land_1).to_netcdf(input_file)
+    setup['common']['disk_or_mem'] = 'mem'
+    run = Common()
+    run.read_json(write_setup(tmp_path / 'setup.json', setup))
+    run.set_backward_files([input_file], [backward_file])
+    _, outputs = run.process_one_file(input_file)
+
+    shape = grid_shape[1:]
+    forward = outputs['FTLE'].FTLE_forward.values
+    backward = outputs['FTLE'].FTLE_backward.values
+    assert np.isnan(forward[land_1.reshape(shape)]).all()
+    assert np.isfinite(forward[land_2.reshape(shape)]).any()
+    assert np.isnan(backward[land_2.reshape(shape)]).all()
+    assert np.isfinite(backward[land_1.reshape(shape)]).any()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import xarray as xr
+from MYCOASTLCS.Common import Common
+from MYCOASTLCS.LCS import LCS, eig_sym_2d
+from conftest import double_gyre, write_setup
+
+
+def test_eig_sym_2d_matches_eigh():
+    rng = np.random.default_rng(0)
+    a, b, c = rng.normal(size=(3, 50))
+    # Diagonal and isotropic matrices
+    b[:10] = 0.
+    c[:5] = a[:5]
+    eigval_min, eigval_max, evec_min, evec_max = eig_sym_2d(a, b, c)
+    H = np.stack([np.stack([a, b], axis=-1),
+                  np.stack([b, c], axis=-1)], axis=-2)
+    eigval, eigvec = np.linalg.eigh(H)
+    np.testing.assert_allclose(eigval_min, eigval[:, 0], atol=1e-12)
+    np.testing.assert_allclose(eigval_max, eigval[:, 1], atol=1e-12)
+    for lam, evec in [(eigval_min, evec_min), (eigval_max, evec_max)]:
+        v = np.stack(evec, axis=-1)
+        np.testing.assert_allclose(np.linalg.norm(v, axis=-1), 1.)
+        np.testing.assert_allclose(np.einsum('...ij,...j->...i', H, v),
+                                   lam[:, np.newaxis]*v, atol=1e-12)
+    # Deterministic sign of the major eigenvector
+    assert (evec_max[0] >= 0).all()
+
+
+@pytest.mark.parametrize('nr_neighb', [1, 2])
+def test_ridge_mask_area_filter_matches_loop(nr_neighb):
+    from skimage.measure import label
+    rng = np.random.default_rng(1)
+    candidates = rng.random((30, 40)) > 0.7
+    # A single point as the last label
+    candidates[-2:, -2:] = [[False, False], [False, True]]
+    candidates[-3, -3:] = False
+    candidates[-2:, -3] = False
+    ftle = np.where(candidates, 1., -1.)
+    lcs = LCS(eval_thrsh=0., ftle_thrsh=0., area_thrsh=3,
+              nr_neighb=nr_neighb)
+    ridge_mask = lcs.get_ridge_mask(ftle, -ftle)
+    L = label(candidates, connectivity=nr_neighb)
+    expected = np.zeros(candidates.shape, dtype=bool)
+    for k in range(1, L.max() + 1):
+        if (L == k).sum() >= lcs.area_thrsh:
+            expected |= L == k
+    np.testing.assert_array_equal(ridge_mask, expected)
+    assert not ridge_mask[-1, -1]
+
+
+def test_ridge_points_match_loop():
+    rng = np.random.default_rng(2)
+    ridge = rng.normal(size=(9, 11))
+    ridge[4, 3:6] = 0.
+    ridge_mask = rng.random(ridge.shape) > 0.4
+    x0, y0 = np.linspace(-2, 3, 11)**3, np.linspace(0, 1, 9)
+    x_ridge, y_ridge = LCS().get_lcs_ridge_points(ridge_mask, ridge, x0, y0)
+    expected = []
+    for along_x in [True, False]:
+        for i in range(0, ridge.shape[0] - (not along_x)):
+            for j in range(0, ridge.shape[1] - along_x):
+                i1, j1 = (i, j + 1) if along_x else (i + 1, j)
+                r0, r1 = ridge[i, j], ridge[i1, j1]
+                if not ((r0*r1 < 0) or (r0 == 0 and r1 != 0)):
+                    continue
+                t = r0/(r0 - r1)
+                if not ridge_mask[(i1, j1) if t >= 0.5 else (i, j)]:
+                    continue
+                if along_x:
+                    expected.append((x0[j] + t*(x0[j1] - x0[j]), y0[i]))
+                else:
+                    expected.append((x0[j], y0[i] + t*(y0[i1] - y0[i])))
+    np.testing.assert_allclose(sorted(zip(x_ridge, y_ridge)),
+                               sorted(expected))
+    assert len(expected) > 0
+
+
+@pytest.mark.parametrize('disk_or_mem', ['mem', 'disk'])
+def test_ridge_points_merged(tmp_path, monkeypatch, setup_2d, disk_or_mem):
+    # The ridge points of every input file are in the merged output,
+    # indexed by time with LCS_forward_point_count.
+    monkeypatch.chdir(tmp_path)
+    setup = {key: setup_2d[key] for key in ['common', 'FTLE', 'LCS']}
+    setup['LCS']['ridge_points_flag'] = 1
+    grid_shape = setup['common']['grid_shape']
+    input_files = []
+    for k, t0 in enumerate([0., 2.5]):
+        input_files.append(str(tmp_path / ('day' + str(k) + '.nc')))
+        ds = double_gyre(grid_shape, t0=t0, start='2020-01-0' + str(k + 1))
+        ds.to_netcdf(input_files[-1])
+
+    # Ridge points of each file alone
+    setup['common']['disk_or_mem'] = 'mem'
+    run = Common()
+    run.read_json(write_setup(tmp_path / 'setup.json', setup))
+    points = [run.process_one_file(input_file)[1]['FTLE']
+              for input_file in input_files]
+
+    setup['common']['disk_or_mem'] = disk_or_mem
+    run = Common()
+    run.read_json(write_setup(tmp_path / 'setup.json', setup))
+    products = run.run_ftle_lcs(str(tmp_path / 'day*.nc'),
+                                str(tmp_path / 'out.nc'))
+    if disk_or_mem == 'mem':
+        ds = products['FTLE']
+    else:
+        ds = xr.open_dataset(tmp_path / 'outftle.nc')
+    count = ds.LCS_forward_point_count.values
+    np.testing.assert_array_equal(count, [ds_file.LCS_forward_x.size
+                                          for ds_file in points])
+    assert (count > 0).all()
+    for var in ['LCS_forward_x', 'LCS_forward_y']:
+        np.testing.assert_array_equal(
+            ds[var].values,
+            np.concatenate([ds_file[var].values for ds_file in points]))
+    ds.close()
+
+
+def test_ridge_stats_without_pandas(monkeypatch):
+    import sys
+    monkeypatch.setitem(sys.modules, 'pandas', None)
+    ds = xr.Dataset({'FTLE_forward': (('y0', 'x0'), np.zeros((4, 4))),
+                     'LCS_forward': (('y0', 'x0'), np.zeros((4, 4)))})
+    with pytest.raises(ImportError, match='stats'):
+        LCS().get_ridge_stats(ds)
+
+
+def test_ridge_stats_without_ftle(tmp_path, setup_2d):
+    setup = {key: setup_2d[key] for key in ['common', 'LCS', 'CONC']}
+    setup['LCS']['ridge_stats'] = True
+    run = Common()
+    run.read_json(write_setup(tmp_path / 'setup.json', setup))
+    with pytest.raises(ValueError, match='FTLE'):
+        run.get_output_filenames(str(tmp_path / 'in.nc'))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import xarray as xr
+from MYCOASTLCS.Common import Common
+from MYCOASTLCS.Manifest import Manifest
+from conftest import double_gyre, write_setup
+
+
+def run_files(tmp_path, setup):
+    """ Multi-file run on disk, returns the merged FTLE output. """
+    run = Common()
+    run.read_json(write_setup(tmp_path / 'setup.json', setup))
+    run.run_ftle_lcs(str(tmp_path / 'day*.nc'), str(tmp_path / 'out.nc'))
+    with xr.open_dataset(tmp_path / 'outftle.nc') as ds:
+        return ds.load()
+
+
+@pytest.mark.parametrize('crash', ['step', 'manifest'])
+def test_resume_after_crash(tmp_path, monkeypatch, setup_2d, crash):
+    # A rolling run that appends two new files to the merged output is
+    # stopped at the last file, or between the append of the first new
+    # file and the manifest update. The resumed run has no duplicated
+    # steps.
+    monkeypatch.chdir(tmp_path)
+    setup = {key: setup_2d[key] for key in ['common', 'FTLE']}
+    setup['common']['manifest'] = str(tmp_path / 'manifest.json')
+    grid_shape = setup['common']['grid_shape']
+
+    def add_files(days):
+        for k in days:
+            double_gyre(grid_shape, t0=0.5*k,
+                        start='2020-01-0' + str(k + 1)).to_netcdf(
+                tmp_path / ('day' + str(k) + '.nc'))
+    add_files([0, 1])
+    run_files(tmp_path, setup)
+    add_files([2, 3])
+
+    with monkeypatch.context() as patch:
+        if crash == 'step':
+            process_step = Common.process_step
+
+            def failing_step(self, input_file):
+                if input_file.endswith('day3.nc'):
+                    raise RuntimeError('crash')
+                return process_step(self, input_file)
+            patch.setattr(Common, 'process_step', failing_step)
+        else:
+            set_merged = Manifest.set_merged
+
+            def failing_set_merged(self, output_file, pieces):
+                if len(pieces) == 3:
+                    raise RuntimeError('crash')
+                return set_merged(self, output_file, pieces)
+            patch.setattr(Manifest, 'set_merged', failing_set_merged)
+        with pytest.raises(RuntimeError, match='crash'):
+            run_files(tmp_path, setup)
+
+    ds = run_files(tmp_path, setup)
+    np.testing.assert_array_equal(
+        ds.time.values, np.array(['2020-01-01', '2020-01-02', '2020-01-03',
+                                  '2020-01-04'], dtype='datetime64[ns]'))
+
+    setup['common'].pop('manifest')
+    reference = run_files(tmp_path, setup)
+    np.testing.assert_array_equal(ds.FTLE_forward.values,
+                                  reference.FTLE_forward.values)
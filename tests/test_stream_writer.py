@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import xarray as xr
+from MYCOASTLCS.Common import Common
+from MYCOASTLCS.StreamWriter import StreamWriter
+from conftest import double_gyre, write_setup
+
+
+def time_step(time, value):
+    """ Dataset of one timestep. """
+    return xr.Dataset({'a': (('time', 'x'), [[value, value]])},
+                      coords={'time': [np.datetime64(time, 'ns')]})
+
+
+def test_append_sub_daily(tmp_path):
+    times = ['2020-01-01T00:00', '2020-01-01T06:00', '2020-01-01T13:30']
+    writer = StreamWriter(str(tmp_path / 'out.nc'))
+    for k, time in enumerate(times):
+        writer.append(time_step(time, k))
+    writer.close()
+    with xr.open_dataset(tmp_path / 'out.nc') as ds:
+        np.testing.assert_array_equal(ds.time.values,
+                                      np.array(times, dtype='datetime64[ns]'))
+        np.testing.assert_array_equal(ds.a.values[:, 0], [0, 1, 2])
+
+
+def test_append_inexact_time(tmp_path):
+    # File created with integer days: 6 hours can not be stored.
+    filename = str(tmp_path / 'out.nc')
+    time_step('2020-01-01', 0).to_netcdf(
+        filename, unlimited_dims=['time'],
+        encoding={'time': {'units': 'days since 2020-01-01',
+                           'dtype': 'int64'}})
+    writer = StreamWriter(filename)
+    writer.open()
+    with pytest.raises(ValueError):
+        writer.append(time_step('2020-01-01T06:00', 1))
+    writer.close()
+
+
+def test_merged_time_sub_daily(tmp_path, monkeypatch, setup_2d):
+    # FTLE of two files with sub-daily steps merged on disk.
+    monkeypatch.chdir(tmp_path)
+    setup = {key: setup_2d[key] for key in ['common', 'FTLE']}
+    grid_shape = setup['common']['grid_shape']
+    for k, start in enumerate(['2020-01-01T00:00', '2020-01-01T06:00']):
+        double_gyre(grid_shape, hours=1., start=start).to_netcdf(
+            tmp_path / ('day' + str(k) + '.nc'))
+
+    ds_ftle = {}
+    for disk_or_mem in ['mem', 'disk']:
+        setup['common']['disk_or_mem'] = disk_or_mem
+        run = Common()
+        run.read_json(write_setup(tmp_path / 'setup.json', setup))
+        products = run.run_ftle_lcs(str(tmp_path / 'day*.nc'),
+                                    str(tmp_path / 'out.nc'))
+        ds_ftle[disk_or_mem] = products['FTLE'] if disk_or_mem == 'mem' \
+            else xr.open_dataset(tmp_path / 'outftle.nc')
+    assert ds_ftle['mem'].time.size == 2
+    np.testing.assert_array_equal(ds_ftle['disk'].time.values,
+                                  ds_ftle['mem'].time.values)
+    np.testing.assert_array_equal(ds_ftle['disk'].FTLE_forward.values,
+                                  ds_ftle['mem'].FTLE_forward.values)
+    ds_ftle['disk'].close()
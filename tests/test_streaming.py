@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import MYCOASTLCS.ResidenceTime as ResidenceTime
+from MYCOASTLCS.Common import Common
+from conftest import double_gyre, land_box, write_setup
+
+
+def run_stages(tmp_path, setup, ds):
+    """ Outputs of one input file kept in memory. """
+    input_file = str(tmp_path / 'in.nc')
+    ds.to_netcdf(input_file)
+    setup['common']['disk_or_mem'] = 'mem'
+    run = Common()
+    run.read_json(write_setup(tmp_path / 'setup.json', setup))
+    return run.process_one_file(input_file)[1]
+
+
+@pytest.mark.parametrize('merge_size', [1, 2**20])
+def test_streamed_residence_time(tmp_path, monkeypatch, setup_2d,
+                                 merge_size):
+    # The visits are merged every chunk or only at the end: the residence
+    # time is the in-memory one.
+    setup = {key: setup_2d[key] for key in ['common', 'CONC', 'RESD']}
+    grid_shape = setup['common']['grid_shape']
+    ds = double_gyre(grid_shape, nt=13,
+                     land=land_box(grid_shape, 1.5, 0.6))
+    reference = run_stages(tmp_path, setup, ds)
+
+    monkeypatch.setattr(ResidenceTime, 'VISITS_MERGE_SIZE', merge_size)
+    setup['common']['stream_time_chunk'] = 2
+    outputs = run_stages(tmp_path, setup, ds)
+    for stage in ['CONC', 'RESD']:
+        for var in reference[stage].data_vars:
+            np.testing.assert_array_equal(outputs[stage][var].values,
+                                          reference[stage][var].values)
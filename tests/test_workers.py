@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import pytest
+from MYCOASTLCS.Common import Common
+from conftest import double_gyre, write_setup
+
+
+def process_step(self, input_file):
+    """ Step of a worker that fails. """
+    raise RuntimeError('step failed: ' + input_file)
+
+
+def test_workers_shut_down_on_error(tmp_path, monkeypatch, setup_2d):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Common, 'process_step', process_step)
+    setup = {key: setup_2d[key] for key in ['common', 'FTLE']}
+    setup['common']['n_workers'] = 2
+    grid_shape = setup['common']['grid_shape']
+    for k in range(0, 2):
+        double_gyre(grid_shape, start='2020-01-0' + str(k + 1)).to_netcdf(
+            tmp_path / ('day' + str(k) + '.nc'))
+    run = Common()
+    run.read_json(write_setup(tmp_path / 'setup.json', setup))
+    with pytest.raises(RuntimeError, match='step failed'):
+        run.run_ftle_lcs(str(tmp_path / 'day*.nc'), str(tmp_path / 'out.nc'))
+    assert multiprocessing.active_children() == []